@@ -0,0 +1,400 @@
+"""
+Замеры скорости основных операций программы без обращения к сайту
+
+Разбор страниц выполняется на файлах из `bench/fixtures`, листы Excel
+создаются синтетические. Для каждого замера выводится скорость
+(записей или страниц в секунду) и пик памяти (tracemalloc).
+Результаты можно сохранить как базовые (`--save`), следующие запуски
+сравниваются с ними, и замедление больше допуска считается регрессом.
+
+    python bench/bench.py
+    python bench/bench.py --quick
+    python bench/bench.py --save
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import openpyxl  # noqa: E402
+
+import parsing  # noqa: E402
+import zakupki  # noqa: E402
+from bad_list import bad_list  # noqa: E402
+from pages import FIXTURES_DIR  # noqa: E402
+from tables import WSWrapper  # noqa: E402
+
+zakupki.import_modules()
+
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+MIN_TIME = 1.0  # секунд на замер
+SIZES = [1000, 10000, 100000]
+QUICK_SIZES = [1000, 10000]
+SAME_NAMED_FILES = [100, 1000]
+LOT_COLUMNS = [
+    "ID",
+    "stage2",
+    "stage3",
+    "fz",
+    "subtype",
+    "link",
+    "number",
+    "stage",
+    "name",
+    "agency_link",
+    "agency",
+    "price",
+    "published",
+    "updated",
+    "last_date",
+]
+
+
+def read_fixture(file_name):
+    with open(os.path.join(FIXTURES_DIR, file_name), encoding="utf-8") as f:
+        return f.read()
+
+
+def lot_row(i):
+    return [
+        i,
+        "done",
+        "no",
+        "44-ФЗ",
+        "Электронный аукцион",
+        f"https://zakupki.gov.ru/epz/order/notice/ea44/view/common-info.html?regNumber={i:019d}",
+        f'"{i:019d}"',
+        "Определение поставщика завершено",
+        f"Поставка медицинских изделий № {i}",
+        "https://zakupki.gov.ru/epz/organization/view/info.html?organizationCode=1",
+        "ГБУЗ «ГОРОДСКАЯ БОЛЬНИЦА № 1»",
+        1000.0 + i,
+        date(2021, 3, 1),
+        date(2021, 3, 2),
+        date(2021, 3, 12),
+    ]
+
+
+def make_workbook(file_name, rows):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("lots")
+    ws.append(LOT_COLUMNS)
+    for i in range(1, rows + 1):
+        ws.append(lot_row(i))
+    wb.save(file_name)
+
+
+class Benchmark:
+    """Measured operation
+
+    Input: `name` - name in the report and the baseline, `units` - what is
+        counted, `count` - units per call, `func` - the operation"""
+
+    def __init__(self, name, units, count, func):
+        self.name = name
+        self.units = units
+        self.count = count
+        self.func = func
+
+    def run(self, min_time=MIN_TIME):
+        """Output: dict with `rate` (units per second) and `peak` (bytes)"""
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            # первый вызов - прогрев, он же замер, если операция долгая
+            started = time.perf_counter()
+            self.func()
+            times = [time.perf_counter() - started]
+            if times[0] < min_time:
+                times = []
+            started = time.perf_counter()
+            while not times or time.perf_counter() - started < min_time:
+                start = time.perf_counter()
+                self.func()
+                times.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            self.func()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        times.sort()
+        median = times[len(times) // 2]
+        return {"rate": self.count / median, "peak": peak}
+
+
+def parsing_benchmarks():
+    search = read_fixture("search_results.html")
+    suppliers = read_fixture("supplier_results.html")
+    common = read_fixture("common_info.html")
+    entries = search.count("search-registry-entry-block box-shadow-search-input")
+
+    def parse_search():
+        zakupki.work_with_searchresult([], parsing.make_soup(search, "search"))
+
+    benchmarks = []
+    backends = [b for b in parsing.BACKENDS if b != "lxml" or parsing.FAST_BACKEND]
+    for backend in backends:
+
+        def use(func, backend=backend):
+            def run():
+                parsing.backend = backend
+                func()
+
+            return run
+
+        benchmarks += [
+            Benchmark(f"search_page[{backend}]", "лотов", entries, use(parse_search)),
+            Benchmark(
+                f"supplier_results[{backend}]",
+                "страниц",
+                1,
+                use(lambda: zakupki.parse_supplier_results(suppliers, {})),
+            ),
+            Benchmark(
+                f"common_info[{backend}]",
+                "страниц",
+                1,
+                use(lambda: zakupki.parse_common_info(common, {})),
+            ),
+        ]
+    return benchmarks
+
+
+def parser_results():
+    """Fields extracted from every fixture page by the current parser"""
+
+    def page(file_name):
+        return read_fixture(file_name).encode("utf-8")
+
+    return {
+        "search_results.html": zakupki.parse_search_page(
+            page("search_results.html"), "utf-8"
+        ),
+        "supplier_results.html": zakupki.parse_lot_page(
+            zakupki.parse_supplier_results, page("supplier_results.html"), "utf-8"
+        ),
+        "common_info.html": zakupki.parse_lot_page(
+            zakupki.parse_common_info, page("common_info.html"), "utf-8"
+        ),
+        "documents.html": zakupki.parse_attachments(
+            page("documents.html"), "utf-8", "lot"
+        ),
+    }
+
+
+def check_parsers():
+    """Compare fields extracted by lxml and html.parser
+
+    Output: names of fixture pages with different results"""
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for backend in parsing.BACKENDS:
+            parsing.backend = backend
+            results[backend] = parser_results()
+    parsing.backend = parsing.FAST_BACKEND or "html.parser"
+    fast, default = (results[b] for b in parsing.BACKENDS)
+    return [name for name in fast if fast[name] != default[name]]
+
+
+def table_benchmarks(work_dir, sizes):
+    benchmarks = []
+    for rows in sizes:
+        file_name = os.path.join(work_dir, f"lots_{rows}.xlsx")
+        make_workbook(file_name, rows)
+        loaded = WSWrapper(openpyxl.open(file_name)["lots"])
+
+        def load(file_name=file_name):
+            WSWrapper(openpyxl.open(file_name)["lots"])
+
+        def iterate(wrapper=loaded):
+            for i in range(len(wrapper)):
+                wrapper[i]
+
+        def append(rows=rows):
+            wb = openpyxl.Workbook()
+            wrapper = WSWrapper(wb.active)
+            for i in range(1, rows + 1):
+                wrapper.append(dict(zip(LOT_COLUMNS[1:], lot_row(i)[1:])))
+
+        def save(rows=rows, file_name=file_name):
+            wb = openpyxl.open(file_name)
+            wrapper = WSWrapper(wb["lots"])
+            # меняется каждая сотая запись
+            for i in range(0, rows, 100):
+                wrapper[i] = {"stage2": "none"}
+            wrapper.flush()
+            wb.save(os.path.join(work_dir, "saved.xlsx"))
+
+        benchmarks += [
+            Benchmark(f"table_load[{rows}]", "строк", rows, load),
+            Benchmark(f"table_iterate[{rows}]", "строк", rows, iterate),
+            Benchmark(f"table_append[{rows}]", "строк", rows, append),
+            Benchmark(f"table_save[{rows}]", "строк", rows, save),
+        ]
+    return benchmarks
+
+
+def file_name_benchmarks(work_dir, counts):
+    benchmarks = []
+    for count in counts:
+        folder = os.path.join(work_dir, f"files_{count}")
+        os.mkdir(folder)
+        file_name = os.path.join(folder, "Документ.docx")
+        name = file_name
+        for _ in range(count):
+            open(name, "w").close()
+            name = zakupki.next_file_name(name)
+
+        benchmarks.append(
+            Benchmark(
+                f"make_do_not_exists[{count}]",
+                "имён",
+                count,
+                lambda file_name=file_name: zakupki.make_do_not_exists(file_name),
+            )
+        )
+    return benchmarks
+
+
+def blacklist_benchmarks(counts):
+    """Matching of lot names of the search fixture against the blacklist,
+    and the same by the former loop of `re.search` over the patterns"""
+
+    soup = parsing.make_soup(read_fixture("search_results.html"), "search")
+    names = [
+        " ".join(block.find("div", class_="registry-entry__body-value").text.split())
+        for block in soup.find_all(
+            "div", class_="search-registry-entry-block box-shadow-search-input"
+        )
+    ]
+
+    benchmarks = []
+    for count in counts:
+        low_names = [f"{names[i % len(names)]} {i}".lower() for i in range(count)]
+
+        def match(low_names=low_names):
+            for low_name in low_names:
+                zakupki.blacklist.match(low_name)
+
+        def re_loop(low_names=low_names):
+            for low_name in low_names:
+                for pattern in bad_list:
+                    if re.search(pattern, low_name):
+                        break
+
+        benchmarks += [
+            Benchmark(f"blacklist_match[{count}]", "имён", count, match),
+            Benchmark(f"blacklist_re_loop[{count}]", "имён", count, re_loop),
+        ]
+    return benchmarks
+
+
+def compare(name, result, baseline, tolerance):
+    """Text of comparison with the baseline, output: (text, is regression)"""
+
+    if name not in baseline:
+        return "нет базы", False
+    ratio = result["rate"] / baseline[name]["rate"]
+    text = f"{ratio:6.2f}x"
+    if ratio < 1 - tolerance:
+        return text + " РЕГРЕСС", True
+    return text, False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Замеры скорости разбора страниц и работы с листами",
+    )
+    parser.add_argument(
+        "--quick",
+        help=f"Листы только на {', '.join(map(str, QUICK_SIZES))} строк",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-k",
+        metavar="TEXT",
+        help="Выполнить только замеры, в имени которых есть TEXT",
+        dest="only",
+    )
+    parser.add_argument(
+        "--save",
+        help=f"Сохранить результаты как базовые в {BASELINE_FILE}",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="Файл базовых результатов для сравнения",
+        default=BASELINE_FILE,
+    )
+    parser.add_argument(
+        "--tolerance",
+        metavar="PART",
+        type=float,
+        help="Допустимое замедление относительно базы (по умолчанию 0.2 - на 20%%)",
+        default=0.2,
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    mismatches = []
+    if parsing.FAST_BACKEND:
+        mismatches = check_parsers()
+        for name in mismatches:
+            print(f"Парсеры {' и '.join(parsing.BACKENDS)} разобрали {name} по-разному")
+        if not mismatches:
+            print(
+                f"Парсеры {' и '.join(parsing.BACKENDS)} разобрали страницы одинаково"
+            )
+
+    work_dir = tempfile.mkdtemp(prefix="zakupki_bench_")
+    try:
+        benchmarks = parsing_benchmarks()
+        benchmarks += table_benchmarks(work_dir, QUICK_SIZES if args.quick else SIZES)
+        benchmarks += file_name_benchmarks(work_dir, SAME_NAMED_FILES)
+        benchmarks += blacklist_benchmarks(QUICK_SIZES if args.quick else SIZES)
+
+        results = {}
+        regressions = 0
+        for benchmark in benchmarks:
+            if args.only and args.only not in benchmark.name:
+                continue
+            result = results[benchmark.name] = benchmark.run()
+            text, regress = compare(benchmark.name, result, baseline, args.tolerance)
+            regressions += regress
+            print(
+                f'{benchmark.name:32s} {result["rate"]:12.1f} {benchmark.units}/с'
+                f'  пик памяти {result["peak"] / 2**20:8.2f} МБ  {text}'
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Результаты сохранены в {args.baseline}")
+    elif regressions:
+        print(f"Замедлений больше допуска: {regressions}")
+    if mismatches or regressions and not args.save:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
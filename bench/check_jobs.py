@@ -0,0 +1,92 @@
+"""
+Проверка первого этапа на файле прошлой версии программы
+
+Прежние версии добавляли строки заданий при каждом запуске, поэтому
+у одного месяца на листе `jobs` бывает несколько строк (например,
+`done` и `error`). Программа запускается на таком файле против
+локального сервера (`mock_server.py`) и должна выполнить все задания.
+
+    python bench/check_jobs.py
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import openpyxl
+
+import mock_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROGRAM = os.path.join(os.path.dirname(BENCH_DIR), "zakupki.py")
+INN = "7700000001"
+# строки листа jobs: месяц 2023/5 записан дважды, 2023/6 - тоже
+LEGACY_JOBS = [
+    ("done", INN, 2023, 5),
+    ("error", INN, 2023, 5),
+    ("error", INN, 2023, 6),
+    ("pending", INN, 2023, 6),
+]
+
+
+def make_legacy_workbook(file_name):
+    wb = openpyxl.Workbook()
+    log = wb.active
+    log.title = "log"
+    log.append(["ID", "Date time"])
+    jobs = wb.create_sheet("jobs", 1)
+    jobs.append(["ID", "state", "INN", "year", "month"])
+    for ID, job in enumerate(LEGACY_JOBS, 1):
+        jobs.append([ID, *job])
+    wb.save(file_name)
+
+
+def main():
+    server = mock_server.make_server(
+        mock_server.command_line_processing(["--port", "0", "--lots-per-day", "1"])
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+
+    work_dir = tempfile.mkdtemp(prefix="zakupki_check_")
+    try:
+        file_name = os.path.join(work_dir, "zakupki.xlsx")
+        make_legacy_workbook(file_name)
+        run = subprocess.run(
+            [
+                sys.executable,
+                PROGRAM,
+                "1",
+                "--file",
+                file_name,
+                "--base-url",
+                f"http://{host}:{port}",
+                "--no-cache",
+                "--no-archive",
+            ],
+            cwd=work_dir,
+            capture_output=True,
+            text=True,
+        )
+        wb = openpyxl.open(file_name)
+        states = [row[1] for row in wb["jobs"].iter_rows(min_row=2, values_only=True)]
+        lots = wb["lots"].max_row - 1 if "lots" in wb else 0
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if run.returncode != 0 or states != ["done"] * len(LEGACY_JOBS) or not lots:
+        print(run.stdout[-2000:])
+        print(run.stderr[-2000:])
+        print(
+            f"Ошибка: код завершения {run.returncode}, задания {states}, лотов {lots}"
+        )
+        sys.exit(1)
+    print(f"Задания прошлой версии выполнены, найдено лотов: {lots}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Локальный сервер, заменяющий сайт zakupki.gov.ru
+
+Отдаёт синтетические страницы результатов поиска (с постраничным
+выводом и счётчиком `более ...` при переполнении), участников, товаров
+и документов лота, а также файлы вложений (с поддержкой Range).
+Задержка ответа, доля ошибок, ответы 429 и размеры страниц и файлов
+настраиваются параметрами, поэтому на нём можно проверять параллельную
+работу, скорость всех этапов и поведение программы при сбоях сайта.
+
+    python bench/mock_server.py --port 8000 --latency 0.05 --error-rate 0.01
+    python zakupki.py -i 7700000001 -y 2021 --base-url http://127.0.0.1:8000 --no-cache
+
+Лоты заказчика определяются его ИНН и датой, поэтому повторные запросы
+видят одни и те же лоты. При остановке (Ctrl+C) выводится статистика.
+"""
+
+import argparse
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pages
+
+SEARCH_PATH = "/epz/order/extendedsearch/results.html"
+SUPPLIERS_PATH = "/epz/order/notice/ea44/view/supplier-results.html"
+COMMON_PATH = "/epz/order/notice/ea44/view/common-info.html"
+DOCUMENTS_PATH = "/epz/order/notice/ea44/view/documents.html"
+FILES_PATH = "/44fz/filestore/public/1.0/download/priz/file.html"
+
+
+def stable_hash(*values):
+    text = "|".join(str(v) for v in values)
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], "big")
+
+
+class MockSite:
+    """Settings, synthetic data and request statistics of the server
+
+    Input: options of the command line (see `command_line_processing`)"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.random = random.Random(args.seed)
+        self.requests = Counter()
+        self.statuses = Counter()
+        # ведро токенов для ограничения количества запросов в секунду
+        self.tokens = args.max_rps
+        self.tokens_time = time.monotonic()
+
+    def count(self, path, status):
+        with self.lock:
+            self.requests[path] += 1
+            self.statuses[status] += 1
+
+    def chance(self, part):
+        with self.lock:
+            return self.random.random() < part
+
+    def rate_limited(self):
+        """True if the request exceeds `--max-rps`"""
+
+        if not self.args.max_rps:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.args.max_rps,
+                self.tokens + (now - self.tokens_time) * self.args.max_rps,
+            )
+            self.tokens_time = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def lots(self, inn, date1, date2):
+        """Lots of the INN published in the period
+
+        Output: list of (number, publish date, update date)"""
+
+        args = self.args
+        prefix = stable_hash(inn) % 10**5
+        lots = []
+        day = date1
+        while day <= date2:
+            count = stable_hash(args.seed, inn, day) % (2 * args.lots_per_day + 1)
+            for k in range(count):
+                n = (prefix * 10**6 + day.toordinal() % 10**6) * 1000 + k
+                updated = day + timedelta(days=n % 5)
+                if stable_hash(args.seed, n) % 10**6 < args.changed * 10**6:
+                    updated = date.today()
+                lots.append((n, day, updated))
+            day += timedelta(days=1)
+        return lots
+
+    def search(self, query):
+        args = self.args
+        inn = query.get("searchString", [""])[0]
+        dated = "publishDateFrom" in query
+        date1 = parse_date(query.get("publishDateFrom", [args.first_date])[0])
+        date2 = parse_date(query.get("publishDateTo", [date.today()])[0])
+        per_page = int(query.get("recordsPerPage", ["_10"])[0].lstrip("_"))
+        page_number = int(query.get("pageNumber", ["1"])[0])
+
+        lots = self.lots(inn, date1, date2)
+        if not dated or query.get("sortBy") == ["UPDATE_DATE"]:
+            lots.sort(key=lambda lot: (lot[2], lot[0]), reverse=True)
+        if len(lots) > args.limit:
+            total = f"более {args.limit} записей"
+            lots = lots[: args.limit]
+        else:
+            total = f"{len(lots)} записей"
+        start = (page_number - 1) * per_page
+        end = start + per_page
+        return pages.search_page(
+            total=total,
+            seed=stable_hash(inn, date1, date2, page_number),
+            lots=lots[start:end],
+            scale=args.page_scale,
+        )
+
+    def file(self, uid):
+        """Content of the attachment file"""
+
+        line = f"Вложение {uid}\n".encode()
+        return (line * (self.args.file_size // len(line) + 1))[: self.args.file_size]
+
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%d.%m.%Y").date()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    site = None
+
+    def log_message(self, format, *args):
+        if self.site.args.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        site = self.site
+        args = site.args
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if args.latency:
+            time.sleep(args.latency * random.uniform(0.5, 1.5))
+
+        if site.rate_limited() or site.chance(args.throttle_rate):
+            site.count(url.path, 429)
+            self.send_empty(429, {"Retry-After": str(args.retry_after)})
+            return
+        if site.chance(args.error_rate):
+            site.count(url.path, 500)
+            self.send_empty(500)
+            return
+
+        base_url = f"http://{self.headers.get('Host', self.server.server_address[0])}"
+        number = query.get("regNumber", [""])[0]
+        if url.path == SEARCH_PATH:
+            body = site.search(query)
+        elif url.path == SUPPLIERS_PATH:
+            body = pages.supplier_page(
+                args.suppliers, stable_hash(number), args.page_scale
+            )
+        elif url.path == COMMON_PATH:
+            body = pages.common_page(args.goods, stable_hash(number), args.page_scale)
+        elif url.path == DOCUMENTS_PATH:
+            body = pages.documents_page(
+                args.files, stable_hash(number), base_url, args.page_scale
+            )
+        elif url.path == FILES_PATH:
+            self.send_file(site.file(query.get("uid", [""])[0]))
+            return
+        else:
+            site.count(url.path, 404)
+            self.send_empty(404)
+            return
+
+        site.count(url.path, 200)
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_file(self, data):
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match and int(match[1]) < len(data):
+            start = int(match[1])
+            self.site.count(FILES_PATH, 206)
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}"
+            )
+            data = data[start:]
+        else:
+            self.site.count(FILES_PATH, 200)
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def make_server(args):
+    """HTTP server of the site (not started)"""
+
+    handler = type("SiteHandler", (Handler,), {"site": MockSite(args)})
+    return ThreadingHTTPServer((args.host, args.port), handler)
+
+
+def report(site):
+    print(f"Запросов: {sum(site.requests.values())}")
+    for path, count in site.requests.most_common():
+        print(f"{count:8d}: {path}")
+    print("Ответы: " + ", ".join(f"{s}: {c}" for s, c in sorted(site.statuses.items())))
+
+
+def command_line_processing(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Локальный сервер, заменяющий сайт zakupki.gov.ru",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Адрес (127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Порт (8000)")
+    parser.add_argument(
+        "--latency",
+        metavar="SEC",
+        type=float,
+        default=0.0,
+        help="Средняя задержка ответа в секундах (0)",
+    )
+    parser.add_argument(
+        "--error-rate",
+        metavar="PART",
+        type=float,
+        default=0.0,
+        help="Доля запросов, на которые отвечается ошибкой 500 (0)",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        metavar="PART",
+        type=float,
+        default=0.0,
+        help="Доля запросов, на которые отвечается 429 Too Many Requests (0)",
+    )
+    parser.add_argument(
+        "--max-rps",
+        metavar="N",
+        type=float,
+        default=0.0,
+        help="Больше N запросов в секунду получают ответ 429 (по умолчанию без ограничения)",
+    )
+    parser.add_argument(
+        "--retry-after",
+        metavar="SEC",
+        type=int,
+        default=1,
+        help="Значение заголовка Retry-After в ответах 429 (1)",
+    )
+    parser.add_argument(
+        "--lots-per-day",
+        metavar="N",
+        type=int,
+        default=3,
+        help="Среднее количество лотов заказчика в день (3)",
+    )
+    parser.add_argument(
+        "--limit",
+        metavar="N",
+        type=int,
+        default=1000,
+        help="Сколько записей поиска показывает сайт, при большем количестве - `более N` (1000)",
+    )
+    parser.add_argument(
+        "--changed",
+        metavar="PART",
+        type=float,
+        default=0.0,
+        help="Доля лотов, обновлённых сегодня, для проверки режима refresh (0)",
+    )
+    parser.add_argument(
+        "--suppliers", metavar="N", type=int, default=3, help="Участников лота (3)"
+    )
+    parser.add_argument(
+        "--goods", metavar="N", type=int, default=20, help="Товаров лота (20)"
+    )
+    parser.add_argument(
+        "--files", metavar="N", type=int, default=5, help="Вложений лота (5)"
+    )
+    parser.add_argument(
+        "--file-size",
+        metavar="BYTES",
+        type=int,
+        default=256 * 1024,
+        help="Размер файла вложения (256 КБ)",
+    )
+    parser.add_argument(
+        "--page-scale",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Во сколько раз увеличить меню и скрипты страниц (1 - около 60 КБ)",
+    )
+    parser.add_argument(
+        "--first-date",
+        metavar="DD.MM.YYYY",
+        type=parse_date,
+        default=date(2019, 1, 1),
+        help="Дата первых лотов для поиска без дат (01.01.2019)",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Начальное число (1)")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Выводить каждый запрос"
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    args = command_line_processing()
+    server = make_server(args)
+    host, port = server.server_address[:2]
+    print(f"Сервер запущен: http://{host}:{port}")
+    print(f"Параметр для zakupki.py: --base-url http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        report(server.RequestHandlerClass.site)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
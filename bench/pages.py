@@ -0,0 +1,236 @@
+"""
+Синтетические страницы сайта zakupki.gov.ru
+
+Страницы повторяют разметку, которую разбирает программа (результаты
+поиска, участники, товары КТРУ, документы лота), вместе с шапкой,
+меню и скриптами, которые делают настоящие страницы большими.
+Все названия, ИНН и номера вымышленные.
+
+Запуск `python bench/pages.py` перезаписывает файлы в `bench/fixtures`.
+"""
+
+import os
+import random
+from datetime import date, timedelta
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+NAMES = [
+    "Поставка расходных материалов для нужд учреждения",
+    "Поставка лекарственных препаратов для медицинского применения",
+    "Поставка медицинских изделий (шовный материал)",
+    "Поставка изделий медицинского назначения для отделения реанимации",
+    "Поставка перчаток медицинских нестерильных",
+    "Оказание услуг по техническому обслуживанию медицинского оборудования",
+    "Поставка реагентов для клинико-диагностической лаборатории",
+    "Поставка катетеров и систем для инфузий",
+]
+CUSTOMERS = [
+    "ГОСУДАРСТВЕННОЕ БЮДЖЕТНОЕ УЧРЕЖДЕНИЕ ЗДРАВООХРАНЕНИЯ «ГОРОДСКАЯ БОЛЬНИЦА № {n}»",
+    "ГБУЗ «ОБЛАСТНАЯ КЛИНИЧЕСКАЯ БОЛЬНИЦА № {n}»",
+    "МУНИЦИПАЛЬНОЕ УЧРЕЖДЕНИЕ «ПОЛИКЛИНИКА № {n}»",
+]
+SUPPLIERS = ["ООО «Ромашка-{n}»", "АО «Медтехника {n}»", "ИП Иванов И. И. ({n})"]
+STAGES = [
+    "Подача заявок",
+    "Работа комиссии",
+    "Определение поставщика завершено",
+    "Определение поставщика отменено",
+]
+
+
+def chrome(rng, body, scale=1):
+    """Wrap the body in header, menu, scripts and footer of the site
+
+    `scale` multiplies the size of menus and scripts"""
+
+    menu = "".join(
+        f'<li class="menu__item"><a class="menu__link" href="/epz/menu/{i}">'
+        f"Раздел {i} {rng.choice(NAMES)[:20]}</a></li>"
+        for i in range(150 * scale)
+    )
+    script = "".join(
+        f"var opt{i} = {{id: {i}, value: '{rng.getrandbits(64):x}'}};\n"
+        for i in range(400 * scale)
+    )
+    return f"""<!DOCTYPE html>
+<html lang="ru"><head><meta charset="UTF-8"><title>ЕИС Закупки</title>
+<link rel="stylesheet" href="/epz/static/css/main.css">
+<script type="text/javascript">{script}</script></head>
+<body><header class="header"><div class="header__top"><ul class="menu">{menu}</ul>
+</div></header>
+<div class="container">{body}</div>
+<footer class="footer"><ul class="menu">{menu}</ul>
+<div class="footer__copyright">Единая информационная система в сфере закупок</div>
+</footer></body></html>
+"""
+
+
+def money(value):
+    whole, cents = f"{value:.2f}".split(".")
+    groups = []
+    while whole:
+        groups.insert(0, whole[-3:])
+        whole = whole[:-3]
+    return "\xa0".join(groups) + "," + cents
+
+
+def search_entry(rng, n, day, updated=None):
+    fz = "223-ФЗ" if n % 4 == 0 else "44-ФЗ"
+    number = f"{3000000000 + n:019d}"
+    if fz == "44-ФЗ":
+        href = f"/epz/order/notice/ea44/view/common-info.html?regNumber={number}"
+    else:
+        href = f"https://zakupki.gov.ru/223/purchase/public/purchase/info/common-info.html?regNumber={number}"
+    shift = timedelta(days=rng.randrange(5))
+    updated = updated or day + shift
+    last = updated + timedelta(days=10)
+    return f"""<div class="search-registry-entry-block box-shadow-search-input">
+<div class="row no-gutters registry-entry__form mr-0">
+<div class="col-9 p-0 registry-entry__header">
+<div class="registry-entry__header-top__title">
+    {fz}
+    Электронный аукцион
+</div>
+<div class="d-flex registry-entry__header-mid align-items-center">
+<div class="registry-entry__header-mid__number"><a href="{href}" target="_blank">
+    № {number}
+</a></div>
+<div class="registry-entry__header-mid__title">{rng.choice(STAGES)}</div>
+</div>
+<div class="registry-entry__body">
+<div class="registry-entry__body-title">Объект закупки</div>
+<div class="registry-entry__body-value">{rng.choice(NAMES)} № {n}</div>
+<div class="registry-entry__body-title">Заказчик</div>
+<div class="registry-entry__body-href"><a href="/epz/organization/view/info.html?organizationCode={n % 97:011d}" target="_blank">
+    {rng.choice(CUSTOMERS).format(n=n % 97)}
+</a></div>
+</div></div>
+<div class="col col d-flex flex-column registry-entry__right-block b-left">
+<div class="price-block"><div class="price-block__title">Начальная цена</div>
+<div class="price-block__value">{money(rng.uniform(1e4, 1e7))} ₽</div></div>
+<div class="data-block mt-auto">
+<div class="data-block__title">Размещено</div>
+<div class="data-block__value">{day.strftime("%d.%m.%Y")}</div>
+<div class="data-block__title">Обновлено</div>
+<div class="data-block__value">{updated.strftime("%d.%m.%Y")}</div>
+<div class="data-block__title">Окончание подачи заявок</div>
+<div class="data-block__value">{last.strftime("%d.%m.%Y")}</div>
+</div></div></div></div>
+"""
+
+
+def search_page(
+    entries=50, total=None, seed=1, first=1, day=date(2021, 3, 1), lots=None, scale=1
+):
+    """Page of `extendedsearch/results.html`
+
+    Input: `entries` - number of lots on the page, `total` - text of the
+        found records counter (by default "`entries` записей"),
+        `first` - number of the first lot, `day` - publish date,
+        `lots` - list of (number, publish date, update date) instead of
+        `entries`, `first` and `day`"""
+
+    rng = random.Random(seed)
+    if lots is None:
+        lots = [(first + i, day, None) for i in range(entries)]
+    if total is None:
+        total = f"{len(lots)} записей"
+    blocks = "".join(search_entry(rng, *lot) for lot in lots)
+    body = f"""<div class="search-results">
+<div class="search-results__total">{total}</div>
+<div class="search-registry-entrys-block">{blocks}</div>
+<div class="paginator-block"><ul class="pages">
+{"".join(f'<li><a class="page__link" data-pagenumber="{i}">{i}</a></li>' for i in range(1, 21))}
+</ul></div></div>"""
+    return chrome(rng, body, scale)
+
+
+def card(header, blocks):
+    return f"""<div class="cardWrapper outerWrapper"><div class="wrapper">
+<div class="cardHeaderBlock"><div class="cardMainInfo">{header}</div></div>
+<div>{blocks}</div></div></div>"""
+
+
+def supplier_page(suppliers=3, seed=1, scale=1):
+    """Page of `supplier-results.html` with customer and `suppliers` rows"""
+
+    rng = random.Random(seed)
+    rows = "".join(
+        f"""<tr class="tableBlock__row">
+<td class="tableBlock__col">{rng.choice(SUPPLIERS).format(n=i)}</td>
+<td class="tableBlock__col">{"Победитель" if i == 1 else "Участник"}</td>
+<td class="tableBlock__col">{money(rng.uniform(1e4, 1e6))}</td></tr>"""
+        for i in range(1, suppliers + 1)
+    )
+    blocks = f"""<div class="row blockInfo">
+<table class="blockInfo__table tableBlock"><thead class="tableBlock__head"><tr>
+<th class="tableBlock__col tableBlock__col_header">Заказчик</th></tr></thead>
+<tbody class="tableBlock__body"><tr class="tableBlock__row"><td class="tableBlock__col">
+    {rng.choice(CUSTOMERS).format(n=seed)}
+</td></tr></tbody></table>
+<table class="blockInfo__table tableBlock"><thead class="tableBlock__head"><tr>
+<th class="tableBlock__col tableBlock__col_header">Участник(и), с которыми планируется заключить контракт</th>
+<th class="tableBlock__col tableBlock__col_header">Статус</th>
+<th class="tableBlock__col tableBlock__col_header">Предложенная цена</th></tr></thead>
+<tbody class="tableBlock__body">{rows}</tbody></table></div>"""
+    return chrome(rng, card("Результаты определения поставщика", blocks), scale)
+
+
+def common_page(goods=20, seed=1, scale=1):
+    """Page of `common-info.html` with `goods` rows of the KTRU table"""
+
+    rng = random.Random(seed)
+    rows = "".join(
+        f"""<tr class="tableBlock__row">
+<td class="tableBlock__col">32.50.13.190-{i:08d}</td>
+<td class="tableBlock__col">Изделие медицинское  тип {i}
+    (размер ≥ {i} мм)</td>
+<td class="tableBlock__col">{rng.randrange(1, 1000)}</td>
+<td class="tableBlock__col">{money(rng.uniform(10, 1e4))}</td>
+<td class="tableBlock__col">{money(rng.uniform(1e3, 1e6))}</td></tr>"""
+        for i in range(1, goods + 1)
+    )
+    blocks = f"""<div class="row blockInfo"><h2 class="blockInfo__title">Общая информация</h2></div>
+<div id="positionKTRU" class="row blockInfo"><table class="blockInfo__table tableBlock">
+<thead class="tableBlock__head"><tr>
+<th class="tableBlock__col tableBlock__col_header">Код позиции</th>
+<th class="tableBlock__col tableBlock__col_header">Наименование товара, работы, услуги</th>
+<th class="tableBlock__col tableBlock__col_header">Количество</th>
+<th class="tableBlock__col tableBlock__col_header">Цена за ед., ₽</th>
+<th class="tableBlock__col tableBlock__col_header">Стоимость позиции, ₽</th></tr></thead>
+<tbody class="tableBlock__body">{rows}</tbody></table></div>"""
+    return chrome(rng, card("Общая информация о закупке", blocks), scale)
+
+
+def documents_page(files=5, seed=1, base_url="https://zakupki.gov.ru", scale=1):
+    """Page of `documents.html` with `files` attachments"""
+
+    rng = random.Random(seed)
+    attachments = "".join(
+        f"""<div class="attachment row"><div class="col-sm-12">
+<span class="section__value"><a href="{base_url}/44fz/filestore/public/1.0/download/priz/file.html?uid={rng.getrandbits(64):X}"
+    title=" Документ {i}.docx ">Документ {i}.docx</a></span></div></div>"""
+        for i in range(1, files + 1)
+    )
+    return chrome(rng, card("Документы закупки", attachments), scale)
+
+
+FIXTURES = {
+    "search_results.html": search_page,
+    "supplier_results.html": supplier_page,
+    "common_info.html": common_page,
+    "documents.html": documents_page,
+}
+
+
+def write_fixtures():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for file_name, make_page in FIXTURES.items():
+        with open(os.path.join(FIXTURES_DIR, file_name), "w", encoding="utf-8") as f:
+            f.write(make_page())
+        print(f"{file_name}: записан")
+
+
+if __name__ == "__main__":
+    write_fixtures()
@@ -0,0 +1,90 @@
+"""
+Чёрный список названий лотов
+
+Шаблоны компилируются один раз при загрузке списка. Перед поиском
+шаблона выполняется быстрая проверка: у большинства шаблонов есть
+обязательное начало из обычных букв (`лекарствен` у
+`лекарствен.*препарат`), и если его нет в названии, название точно не
+подходит под шаблон, а регулярное выражение не выполняется.
+"""
+
+import re
+import threading
+
+from bad_list import bad_list
+
+# символы регулярных выражений, на которых заканчивается буквальное начало
+SPECIAL = set(".^$*+?{}[]\\|()")
+
+
+def literal_prefix(pattern):
+    """Literal start of the pattern which is present in every match
+
+    Output: the prefix or "" if the pattern has none"""
+
+    if "|" in pattern:
+        return ""
+    prefix = ""
+    for char in pattern:
+        if char in SPECIAL:
+            if char in "*?{":
+                # предыдущий символ может отсутствовать
+                prefix = prefix[:-1]
+            break
+        prefix += char
+    return prefix
+
+
+def read_patterns(file_name):
+    """Read patterns from the file: one per line, `#` starts a comment"""
+
+    patterns = []
+    with open(file_name, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                patterns.append(line)
+    return patterns
+
+
+class Blacklist:
+    """Matcher of lot names against the list of regexp patterns
+
+    Input: `patterns` - list of regexps for lower case names"""
+
+    def __init__(self, patterns=bad_list):
+        self.patterns = list(patterns)
+        self.counts = [0] * len(self.patterns)
+        self.lock = threading.Lock()
+
+        # (буквальное начало, скомпилированный шаблон)
+        self.checks = [(literal_prefix(p), re.compile(p)) for p in self.patterns]
+
+    def match(self, low_name):
+        """The first pattern of the list matching the name or None"""
+
+        for i, (prefix, pattern) in enumerate(self.checks):
+            if prefix in low_name and pattern.search(low_name):
+                with self.lock:
+                    self.counts[i] += 1
+                return self.patterns[i]
+        return None
+
+    def add_counts(self, counts):
+        """Add counts of matched names collected by another matcher"""
+
+        with self.lock:
+            for i, count in enumerate(counts):
+                self.counts[i] += count
+
+    def report(self):
+        rejected = sorted(
+            (count, pattern)
+            for count, pattern in zip(self.counts, self.patterns)
+            if count
+        )
+        if not rejected:
+            return
+        print(f"Отброшено по чёрному списку лотов: {sum(self.counts)}")
+        for count, pattern in reversed(rejected):
+            print(f"{count:6d}: {pattern}")
@@ -0,0 +1,170 @@
+"""
+Общее хранилище скачанных вложений
+
+Каждый файл хранится один раз под именем - хэшем SHA-256 содержимого,
+а в папки лотов попадает жёсткой ссылкой на него (или копией, если
+файловая система не поддерживает ссылки). Поэтому типовые документы,
+приложенные к разным лотам, занимают место на диске один раз.
+В индексе (SQLite файл в папке хранилища) для каждого адреса вложения
+записаны хэш, размер и ETag: файлы на сайте не меняются под своим
+адресом, и повторный запуск берёт уже скачанный файл из хранилища,
+не обращаясь к сайту.
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+INDEX_FILE_NAME = "index.db"
+READ_SIZE = 1024 * 1024
+# ошибки os.link, при которых файл копируется: другой диск, файловая
+# система без жёстких ссылок
+COPY_ERRORS = {errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+def file_hash(file_name):
+    """SHA-256 of the file content (hex)"""
+
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileStore:
+    """Content-addressed store of attachments with index by url
+
+    Input: `folder` - folder of the store, it is created if not exists"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.reused_bytes = 0
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+        os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(
+            os.path.join(folder, INDEX_FILE_NAME),
+            check_same_thread=False,
+            # папку файлов могут одновременно использовать несколько шардов
+            timeout=30,
+        )
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                url TEXT PRIMARY KEY,
+                hash TEXT,
+                size INTEGER,
+                etag TEXT,
+                stored REAL
+            )"""
+        )
+        self.db.commit()
+
+    def object_path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def find(self, url):
+        """Path of the stored file downloaded from `url` or None"""
+
+        with self.lock:
+            entry = self.db.execute(
+                "SELECT hash, size FROM files WHERE url = ?", (url,)
+            ).fetchone()
+        if entry is None:
+            return None
+
+        digest, size = entry
+        path = self.object_path(digest)
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            # файл удалён из хранилища вручную - его надо скачать заново
+            with self.lock:
+                self.db.execute("DELETE FROM files WHERE url = ?", (url,))
+                self.db.commit()
+            return None
+
+        with self.lock:
+            self.reused += 1
+            self.reused_bytes += size
+        return path
+
+    def add(self, file_name, url, etag=None):
+        """Move downloaded file into the store
+
+        Input: `file_name` - downloaded file, `url` - its address,
+            `etag` - ETag header of the response
+        Output: path of the stored file"""
+
+        digest = file_hash(file_name)
+        size = os.path.getsize(file_name)
+        path = self.object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            # такой же файл уже скачан по другому адресу
+            os.remove(file_name)
+            with self.lock:
+                self.duplicates += 1
+                self.duplicate_bytes += size
+        else:
+            os.replace(file_name, path)
+
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (url, digest, size, etag, time.time()),
+            )
+            self.db.commit()
+        return path
+
+    def is_stored(self, path, file_name):
+        """True if `file_name` has the same content as the stored file `path`"""
+
+        if not os.path.isfile(file_name):
+            return False
+        if os.path.samefile(path, file_name):
+            return True
+        if os.path.getsize(path) != os.path.getsize(file_name):
+            return False
+        return file_hash(file_name) == os.path.basename(path)
+
+    def link(self, path, file_name):
+        """Make `file_name` a hard link to the stored file `path` (or its copy)
+
+        An existing file is never overwritten: writing into it could change
+        the stored file through another link
+        Output: False if `file_name` already exists"""
+
+        try:
+            os.link(path, file_name)
+            return True
+        except FileExistsError:
+            return False
+        except OSError as e:
+            if e.errno not in COPY_ERRORS:
+                raise
+        # имя занимается пустым файлом, копия появляется под ним целиком
+        try:
+            os.close(os.open(file_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        temp_name = file_name + ".tmp"
+        shutil.copyfile(path, temp_name)
+        os.replace(temp_name, file_name)
+        return True
+
+    def report(self):
+        if not (self.reused or self.duplicates):
+            return
+        print(
+            f"Хранилище {self.folder}: взято без скачивания {self.reused} файлов"
+            f" ({self.reused_bytes / 2**20:.1f} МБ), совпали с уже скачанными"
+            f" {self.duplicates} ({self.duplicate_bytes / 2**20:.1f} МБ)"
+        )
+
+    def close(self):
+        self.db.close()
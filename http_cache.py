@@ -0,0 +1,211 @@
+"""
+Дисковый кэш ответов сайта
+
+Ответы хранятся в SQLite файле рядом с основным файлом программы.
+Ключ записи - адрес страницы вместе с упорядоченными параметрами запроса.
+Срок жизни записи зависит от страницы: результаты поиска устаревают
+быстро, карточки завершённых закупок почти не меняются. Устаревшая
+запись перепроверяется на сайте по ETag/Last-Modified, если сайт их
+прислал. При превышении размера кэша удаляются записи, которые дольше
+всего не читались.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# срок жизни записи по окончанию адреса страницы
+ENDPOINT_TTLS = {
+    "extendedsearch/results.html": 1 * HOUR,
+    "supplier-results.html": 1 * DAY,
+    "common-info.html": 1 * DAY,
+    "documents.html": 1 * DAY,
+}
+DEFAULT_TTL = 1 * HOUR
+# срок жизни карточек закупок, которые уже не изменятся
+FINAL_TTL = 30 * DAY
+
+MAX_SIZE = 512 * 2**20  # байт
+# причина ответа 504, которым отвечает кэш без сайта (`only`) при промахе
+CACHE_MISS_REASON = "Not in cache"
+
+
+def make_key(url, params):
+    """Make cache key from url and query parameters"""
+
+    query = urlencode(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+    return hashlib.sha1(f"{url}?{query}".encode()).hexdigest()
+
+
+def endpoint_ttl(url, final=False):
+    if final:
+        return FINAL_TTL
+    path = url.split("?", 1)[0]
+    for tail, ttl in ENDPOINT_TTLS.items():
+        if path.endswith(tail):
+            return ttl
+    return DEFAULT_TTL
+
+
+class ResponseCache:
+    """Persistent cache of successful responses with LRU eviction
+
+    Input: `file_name` - SQLite file of the cache,
+        `only` - serve responses only from the cache, never from the site,
+        `max_size` - size limit of stored pages in bytes"""
+
+    def __init__(self, file_name, only=False, max_size=MAX_SIZE):
+        self.only = only
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.db = sqlite3.connect(file_name, check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                encoding TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB,
+                size INTEGER,
+                fetched REAL,
+                accessed REAL
+            )"""
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.db.commit()
+
+    def get(self, fetch, url, params=None, final=False):
+        """Get response from the cache or by `fetch(url, params, headers)`"""
+
+        key = make_key(url, params)
+        with self.lock:
+            entry = self.db.execute(
+                "SELECT url, encoding, etag, last_modified, body, fetched "
+                "FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+        now = time.time()
+        if entry is not None:
+            cached_url, encoding, etag, last_modified, body, fetched = entry
+            if self.only or now - fetched < endpoint_ttl(url, final):
+                self.touch(key, now)
+                self.hits += 1
+                return make_response(cached_url, encoding, zlib.decompress(body))
+
+        if self.only:
+            self.misses += 1
+            # в адресе ответа - параметры запроса, по нему запрос можно повторить
+            full_url = requests.Request("GET", url, params=params).prepare().url
+            response = make_response(full_url, None, b"", status_code=504)
+            response.reason = CACHE_MISS_REASON
+            return response
+
+        conditional = {}
+        if entry is not None:
+            if etag:
+                conditional["if-none-match"] = etag
+            if last_modified:
+                conditional["if-modified-since"] = last_modified
+
+        response = fetch(url, params, conditional or None)
+
+        if response.status_code == 304 and entry is not None:
+            self.touch(key, now, fetched=now)
+            self.revalidated += 1
+            return make_response(cached_url, encoding, zlib.decompress(body))
+
+        self.misses += 1
+        if response.status_code == 200:
+            self.store(key, response, now)
+        return response
+
+    def touch(self, key, now, fetched=None):
+        with self.lock:
+            if fetched is None:
+                self.db.execute(
+                    "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+                )
+            else:
+                self.db.execute(
+                    "UPDATE responses SET accessed = ?, fetched = ? WHERE key = ?",
+                    (now, fetched, key),
+                )
+            self.db.commit()
+
+    def store(self, key, response, now):
+        body = zlib.compress(response.content)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    response.url,
+                    response.encoding,
+                    response.headers.get("etag"),
+                    response.headers.get("last-modified"),
+                    body,
+                    len(body),
+                    now,
+                    now,
+                ),
+            )
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        (size,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if size <= self.max_size:
+            return
+        # удаляем давно не читавшиеся записи, пока не освободим 10% лимита
+        excess = size - int(self.max_size * 0.9)
+        rows = self.db.execute("SELECT key, size FROM responses ORDER BY accessed")
+        keys = []
+        for key, entry_size in rows:
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= entry_size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+    def report(self):
+        if self.only:
+            print(f"Кэш: из кэша {self.hits}, не найдено в кэше {self.misses}")
+            return
+        print(
+            f"Кэш: из кэша {self.hits}, перепроверено на сайте {self.revalidated}, скачано {self.misses}"
+        )
+
+    def close(self):
+        self.db.close()
+
+
+def make_response(url, encoding, content, status_code=200):
+    """Make `requests.Response` from the cached page"""
+
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.encoding = encoding
+    response.headers = CaseInsensitiveDict()
+    response._content = content
+    response.request = requests.Request("GET", url).prepare()
+    return response
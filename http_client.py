@@ -0,0 +1,240 @@
+"""
+Общий HTTP-клиент для всех этапов работы программы
+
+Все запросы к сайту идут через одну сессию `requests` с пулом
+keep-alive соединений, поэтому TCP/TLS соединение с сайтом
+устанавливается один раз на поток, а не на каждый запрос.
+Скорость и количество одновременных запросов подстраиваются под сайт
+(см. `rate_limit`); на ответ 429 запрос повторяется после паузы,
+которую назначил сайт. Полученные страницы дописываются в архив
+(см. `page_archive`).
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import metrics
+from http_cache import ResponseCache
+from page_archive import PageArchive
+from rate_limit import RateLimiter
+
+try:
+    import brotli  # noqa: F401 - urllib3 сам распакует ответ в формате br
+except ModuleNotFoundError:
+    ACCEPT_ENCODING = "gzip, deflate"
+else:
+    ACCEPT_ENCODING = "gzip, deflate, br"
+
+DEFAULT_HEADERS = {
+    "user-agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:97.0) Gecko/20100101 Firefox/97.0",
+    "accept-encoding": ACCEPT_ENCODING,
+}
+
+# (таймаут соединения, таймаут чтения) в секундах для каждого этапа
+STAGE_TIMEOUTS = {
+    1: (10, 60),
+    2: (10, 60),
+    3: (10, 120),
+}
+# сколько раз повторять запрос, на который сайт ответил 429
+THROTTLE_RETRIES = 5
+
+
+class ConnectionStats:
+    """Thread-safe counter of requests and opened connections"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def request_sent(self):
+        with self.lock:
+            self.requests += 1
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+
+    @property
+    def reused(self):
+        return max(self.requests - self.connections, 0)
+
+
+stats = ConnectionStats()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        stats.connection_opened()
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        stats.connection_opened()
+        return super()._new_conn()
+
+
+class CountingAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools count opened connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+class HttpClient:
+    """Session with keep-alive connection pool shared by all threads
+
+    Input: `pool_size` - number of connections kept alive for the site,
+        `timeout` - default timeout of requests,
+        `cache` - ResponseCache for pages or None,
+        `max_rate` - limit of requests per second or None,
+        `archive` - PageArchive for fetched pages or None"""
+
+    def __init__(
+        self,
+        pool_size=1,
+        timeout=STAGE_TIMEOUTS[1],
+        cache=None,
+        max_rate=None,
+        archive=None,
+    ):
+        self.timeout = timeout
+        self.cache = cache
+        self.archive = archive
+        self.limiter = RateLimiter(pool_size, max_rate)
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = CountingAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(
+        self, url, params=None, headers=None, stream=False, timeout=None, final=False
+    ):
+        """GET request; pages (not streamed files) go through the cache
+
+        `final` marks pages of completed procurements that will not change"""
+
+        def fetch(url, params, conditional):
+            endpoint = urlparse(url).path
+            for attempt in range(THROTTLE_RETRIES + 1):
+                response = self.send(
+                    endpoint,
+                    url,
+                    params=params,
+                    headers=dict(headers or {}, **(conditional or {})),
+                    stream=stream,
+                    timeout=timeout or self.timeout,
+                )
+                if attempt == THROTTLE_RETRIES or not throttled(response):
+                    if self.archive is not None and not stream:
+                        self.archive.add(response, params)
+                    return response
+                # limiter уже назначил паузу, запрос повторится после неё
+                response.close()
+
+        if stream or self.cache is None:
+            return fetch(url, params, None)
+        return self.cache.get(fetch, url, params, final)
+
+    def send(self, endpoint, url, **kwargs):
+        """One request through the limiter, its duration goes to metrics"""
+
+        self.limiter.acquire()
+        stats.request_sent()
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException as e:
+            seconds = time.perf_counter() - started
+            metrics.record("http", endpoint, type(e).__name__, seconds)
+            self.limiter.release(endpoint, e, seconds)
+            raise
+        # у скачиваемых файлов время - до получения заголовков ответа
+        if kwargs["stream"]:
+            size = int(response.headers.get("Content-Length") or 0)
+        else:
+            size = len(response.content)
+        seconds = time.perf_counter() - started
+        metrics.record("http", endpoint, response.status_code, seconds, size)
+        self.limiter.release(endpoint, response.status_code, seconds, response)
+        return response
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.archive is not None:
+            self.archive.close()
+
+
+def throttled(response):
+    """True if the site asks to repeat the request later"""
+
+    if response.status_code == 429:
+        return True
+    return response.status_code == 503 and "Retry-After" in response.headers
+
+
+client = HttpClient()
+
+
+def configure(
+    workers=1,
+    stage=1,
+    cache_file=None,
+    cache_only=False,
+    max_rate=None,
+    archive_file=None,
+):
+    """Create the client for the stage: pool is sized to the worker count
+
+    Without `cache_file` responses are not cached, without `archive_file`
+    pages are not archived, `max_rate` limits requests per second"""
+
+    global client
+    client.close()
+    cache = None
+    if cache_file:
+        cache = ResponseCache(cache_file, only=cache_only)
+    archive = None
+    if archive_file:
+        archive = PageArchive(archive_file)
+    # на этапе 2 каждый поток скачивает две страницы лота одновременно
+    client = HttpClient(
+        pool_size=2 * workers,
+        timeout=STAGE_TIMEOUTS.get(stage, STAGE_TIMEOUTS[1]),
+        cache=cache,
+        max_rate=max_rate,
+        archive=archive,
+    )
+
+
+def get(url, params=None, headers=None, stream=False, timeout=None, final=False):
+    return client.get(url, params, headers, stream, timeout, final)
+
+
+def close():
+    client.close()
+
+
+def report():
+    print(
+        f"HTTP-запросов: {stats.requests}, соединений открыто: {stats.connections}, переиспользовано: {stats.reused}"
+    )
+    client.limiter.report()
+    if client.cache is not None:
+        client.cache.report()
+    if client.archive is not None:
+        client.archive.report()
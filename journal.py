@@ -0,0 +1,92 @@
+"""
+Журнал изменений Excel файла
+
+Каждое изменение записи на листах (`jobs`, `lots`, `log`) сразу
+дописывается строкой JSON в файл журнала рядом с Excel файлом.
+Если программа завершилась аварийно и не сохранила Excel файл,
+при следующем запуске журнал применяется к загруженным листам.
+После успешного сохранения Excel файла журнал удаляется.
+"""
+
+import os
+import threading
+
+from storage import from_json, to_json
+
+
+class Journal:
+    """Append-only JSON Lines journal of changes of the workbook sheets
+
+    Input: `file_name` - file of the journal"""
+
+    # Каждая строка сразу передаётся системе (flush) и не теряется при
+    # аварии программы, а на диск (fsync) строки сбрасываются пачками:
+    # после SYNC_EVERY строк или не позже SYNC_INTERVAL секунд после записи
+    SYNC_EVERY = 100
+    SYNC_INTERVAL = 1.0  # секунд
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.file = None
+        self.unsynced = 0
+        # таймер сброса на диск строк, записанных после последнего fsync
+        self.timer = None
+
+    def entries(self):
+        """Read entries written by previous runs"""
+
+        if not os.path.exists(self.file_name):
+            return []
+        entries = []
+        with open(self.file_name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(from_json(line))
+                except ValueError:
+                    # последняя строка могла не дописаться при аварии
+                    break
+        return entries
+
+    def write(self, sheet, ID, record, new=False):
+        line = to_json({"sheet": sheet, "ID": ID, "new": new, "record": record})
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.file_name, "a", encoding="utf-8")
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.SYNC_EVERY:
+                self.sync()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.SYNC_INTERVAL, self.timed_sync)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def timed_sync(self):
+        with self.lock:
+            self.timer = None
+            self.sync()
+
+    def sync(self):
+        if self.file is None or not self.unsynced:
+            return
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.file is not None:
+                self.sync()
+                self.file.close()
+                self.file = None
+
+    def compact(self):
+        """Remove the journal: all its changes are saved in the workbook"""
+
+        self.close()
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
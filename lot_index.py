@@ -0,0 +1,71 @@
+"""
+Индекс состояния Excel файла
+
+После каждого сохранения Excel файла рядом с ним записывается небольшой
+JSON файл: номера и статусы этапов всех лотов и количество невыполненных
+заданий поиска, а также размер и время изменения самого Excel файла.
+Если Excel файл с тех пор не менялся (его не открывали и не сохраняли
+в редакторе), по индексу без загрузки файла видно, есть ли работа
+у запущенного этапа. Загрузка большого файла занимает больше времени,
+чем всё остальное, поэтому запуск, которому нечего делать, сразу
+завершается.
+"""
+
+import json
+import os
+
+# поля лотов в индексе
+FIELDS = ["ID", "number", "stage2", "stage3"]
+
+
+def file_signature(file_name):
+    stat = os.stat(file_name)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_index(file_name, workbook_name, lots, jobs):
+    """Write the index of the just saved workbook
+
+    Input: `file_name` - file of the index, `workbook_name` - Excel file,
+        `lots`, `jobs` - tables (WSWrapper) of its sheets"""
+
+    data = {
+        "workbook": file_signature(workbook_name),
+        "lots": [list(row) for row in zip(*(lots.column(f) for f in FIELDS))],
+        "jobs": sum(1 for state in jobs.column("state") if state != "done"),
+    }
+    temp_name = file_name + ".tmp"
+    with open(temp_name, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(temp_name, file_name)
+
+
+def read_index(file_name, workbook_name):
+    """Index of the workbook or None if the workbook was changed after it"""
+
+    try:
+        with open(file_name, encoding="utf-8") as f:
+            data = json.load(f)
+        if data["workbook"] != file_signature(workbook_name):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return data
+
+
+def has_work(index, stage):
+    """False if the stage surely has nothing to do with the workbook
+
+    The same conditions as stages use to choose lots and jobs"""
+
+    lots = [dict(zip(FIELDS, row)) for row in index["lots"]]
+    stage_two = any(lot["stage2"] in ["none", "error"] for lot in lots)
+    if stage == 1:
+        return index["jobs"] > 0
+    if stage == 2:
+        return stage_two
+    if stage == 3:
+        return any(lot["stage3"] not in ["no", "done"] for lot in lots)
+    if stage == "auto":
+        return index["jobs"] > 0 or stage_two
+    return True
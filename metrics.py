@@ -0,0 +1,216 @@
+"""
+Замеры времени работы программы
+
+Каждый HTTP-запрос, разбор страницы и загрузка/сохранение данных
+записываются с категорией (`http`, `parse`, `workbook`), именем
+(для запросов - путь страницы сайта) и статусом (код ответа сайта,
+`ok` или имя исключения). По ним считаются количество, объём
+и перцентили времени p50/p95/p99. Итог выводится в конце работы,
+записывается на лист `log` и, по желанию, в JSON файл.
+
+Параметр `--profile` записывает профиль cProfile всех потоков.
+"""
+
+import contextlib
+import cProfile
+import functools
+import json
+import pstats
+import sys
+import threading
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """Thread-safe collection of durations by (category, name, status)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        # (категория, имя, статус) -> [количество, байт, список длительностей]
+        self.samples = defaultdict(lambda: [0, 0, []])
+
+    def record(self, category, name, status, seconds, size=0):
+        with self.lock:
+            sample = self.samples[category, name, str(status)]
+            sample[0] += 1
+            sample[1] += size
+            sample[2].append(seconds)
+
+    def merge(self, samples):
+        """Add samples collected in another process"""
+
+        with self.lock:
+            for key, (count, size, durations) in samples.items():
+                sample = self.samples[key]
+                sample[0] += count
+                sample[1] += size
+                sample[2].extend(durations)
+
+    def summary(self):
+        """List of dicts: category, name, status, count, bytes, seconds,
+        p50, p95, p99 (seconds)"""
+
+        rows = []
+        with self.lock:
+            items = sorted(self.samples.items())
+        for (category, name, status), (count, size, durations) in items:
+            durations = sorted(durations)
+            rows.append(
+                {
+                    "category": category,
+                    "name": name,
+                    "status": status,
+                    "count": count,
+                    "bytes": size,
+                    "seconds": sum(durations),
+                    "p50": percentile(durations, 50),
+                    "p95": percentile(durations, 95),
+                    "p99": percentile(durations, 99),
+                }
+            )
+        return rows
+
+    def totals(self):
+        """Run summary for the `log` sheet"""
+
+        with self.lock:
+            http = sorted(
+                seconds
+                for (category, _, _), (_, _, durations) in self.samples.items()
+                if category == "http"
+                for seconds in durations
+            )
+        rows = self.summary()
+        return {
+            "Run time": round(time.monotonic() - self.start_time, 3),
+            "HTTP requests": sum(r["count"] for r in rows if r["category"] == "http"),
+            "HTTP errors": sum(
+                r["count"]
+                for r in rows
+                if r["category"] == "http" and not r["status"].startswith(("2", "3"))
+            ),
+            "HTTP bytes": sum(r["bytes"] for r in rows if r["category"] == "http"),
+            "HTTP p50": round(percentile(http, 50), 3),
+            "HTTP p95": round(percentile(http, 95), 3),
+            "HTTP p99": round(percentile(http, 99), 3),
+            "Parse time": round(
+                sum(r["seconds"] for r in rows if r["category"] == "parse"), 3
+            ),
+            "Workbook time": round(
+                sum(r["seconds"] for r in rows if r["category"] == "workbook"), 3
+            ),
+        }
+
+
+def percentile(durations, p):
+    """Nearest-rank percentile of the sorted list"""
+
+    if not durations:
+        return 0.0
+    rank = max(1, -(-len(durations) * p // 100))
+    return durations[int(rank) - 1]
+
+
+metrics = Metrics()
+
+
+def record(category, name, status, seconds, size=0):
+    metrics.record(category, name, status, seconds, size)
+
+
+@contextlib.contextmanager
+def timer(category, name):
+    """Record the duration of the block
+
+    Status is `ok` or the name of the raised exception"""
+
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        record(category, name, status, time.perf_counter() - started)
+
+
+def timed(category, name):
+    """Decorator: record durations of calls of the function"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(category, name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def report():
+    rows = metrics.summary()
+    if not rows:
+        return
+    print("Замеры времени (количество, МБ, всего с, p50/p95/p99 мс):")
+    for r in rows:
+        print(
+            f'{r["category"]:8s} {r["name"][:48]:48s} {r["status"]:>8s}'
+            f' {r["count"]:7d} {r["bytes"] / 2**20:9.2f} {r["seconds"]:9.2f}'
+            f' {r["p50"] * 1000:8.1f} {r["p95"] * 1000:8.1f} {r["p99"] * 1000:8.1f}'
+        )
+
+
+def write_json(file_name, info):
+    """Write run information `info` with totals and all metrics to the file"""
+
+    data = dict(info, totals=metrics.totals(), metrics=metrics.summary())
+    with open(file_name, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+
+
+class Profiler:
+    """cProfile of the main thread and all threads started after `start`"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = []
+
+    def start(self):
+        if sys.version_info < (3, 12):
+            # новый поток при первом событии включает свой профиль
+            threading.setprofile(self.start_thread)
+        # с Python 3.12 cProfile работает через sys.monitoring и один профиль
+        # записывает все потоки; второй профиль включить нельзя
+        self.start_thread()
+
+    def start_thread(self, *args):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # уже работает другой профилировщик - поток без профиля
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def dump(self, file_name):
+        """Write profiles of all threads as one pstats file"""
+
+        threading.setprofile(None)
+        if not self.profiles:
+            print("Профиль не записан: профилировщик не был включён")
+            return
+        main, *others = self.profiles
+        main.disable()
+        stats = pstats.Stats(main)
+        for profile in others:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # поток не успел выполнить ни одной функции
+                continue
+        stats.dump_stats(file_name)
@@ -0,0 +1,150 @@
+"""
+Архив скачанных страниц сайта
+
+Каждая страница, полученная с сайта (результаты поиска, участники,
+общая информация и документы лота), дописывается в SQLite файл вместе
+с адресом, номером лота (для поиска - ИНН) и временем скачивания.
+Содержимое хранится сжатым, одинаковые страницы - один раз. В отличие
+от кэша, из архива ничего не удаляется: команда `reparse` заново
+разбирает сохранённые страницы без обращения к сайту, например после
+изменения разметки сайта или добавления новых полей.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+
+# вид страницы по окончанию адреса
+KINDS = {
+    "extendedsearch/results.html": "search",
+    "supplier-results.html": "suppliers",
+    "common-info.html": "common",
+    "documents.html": "documents",
+}
+# параметр запроса, по которому находятся страницы вида
+KEY_PARAMS = {"search": "searchString"}
+DEFAULT_KEY_PARAM = "regNumber"
+
+
+def page_kind(url):
+    path = url.split("?", 1)[0]
+    for tail, kind in KINDS.items():
+        if path.endswith(tail):
+            return kind
+    return None
+
+
+def unpack(body):
+    """Content of the archived page"""
+
+    return zlib.decompress(body)
+
+
+class PageArchive:
+    """Append-only archive of pages with index by kind and key
+
+    Input: `file_name` - SQLite file of the archive"""
+
+    # страницы фиксируются в архиве пачками
+    COMMIT_EVERY = 200
+
+    def __init__(self, file_name):
+        self.lock = threading.Lock()
+        self.added = 0
+        self.duplicates = 0
+        self.uncommitted = 0
+        self.db = sqlite3.connect(file_name, check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                ID INTEGER PRIMARY KEY,
+                kind TEXT,
+                key TEXT,
+                url TEXT,
+                fetched REAL,
+                hash TEXT
+            )"""
+        )
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS bodies (
+                hash TEXT PRIMARY KEY,
+                encoding TEXT,
+                body BLOB
+            )"""
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS pages_kind_key ON pages (kind, key, ID)"
+        )
+        self.db.commit()
+
+    def add(self, response, params=None):
+        """Append the page of the site if it is of a known kind"""
+
+        kind = page_kind(response.url)
+        if kind is None or response.status_code != 200:
+            return
+        key = (params or {}).get(KEY_PARAMS.get(kind, DEFAULT_KEY_PARAM))
+        content = response.content
+        digest = hashlib.sha1(content).hexdigest()
+        with self.lock:
+            known = self.db.execute(
+                "SELECT 1 FROM bodies WHERE hash = ?", (digest,)
+            ).fetchone()
+        # сжатие - вне блокировки, его могут выполнять несколько потоков
+        body = None if known else zlib.compress(content)
+        with self.lock:
+            if body is None:
+                self.duplicates += 1
+            else:
+                self.db.execute(
+                    "INSERT OR IGNORE INTO bodies VALUES (?, ?, ?)",
+                    (digest, response.encoding, body),
+                )
+            self.db.execute(
+                "INSERT INTO pages (kind, key, url, fetched, hash) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, response.url, time.time(), digest),
+            )
+            self.added += 1
+            self.uncommitted += 1
+            if self.uncommitted >= self.COMMIT_EVERY:
+                self.save()
+
+    def pages(self, kind):
+        """All pages of the kind in order of fetching
+
+        Output: iterator of (key, URL, encoding, compressed body)"""
+
+        return self.db.execute(
+            "SELECT key, url, encoding, body FROM pages JOIN bodies USING (hash) "
+            "WHERE kind = ? ORDER BY ID",
+            (kind,),
+        )
+
+    def latest(self, kinds):
+        """The last fetched page of every key of the kinds, ordered by key
+
+        Output: iterator of (key, kind, encoding, compressed body)"""
+
+        marks = ", ".join("?" * len(kinds))
+        return self.db.execute(
+            "SELECT key, kind, encoding, body FROM pages JOIN bodies USING (hash) "
+            f"WHERE ID IN (SELECT MAX(ID) FROM pages WHERE kind IN ({marks}) "
+            "GROUP BY kind, key) ORDER BY key, kind",
+            kinds,
+        )
+
+    def report(self):
+        if self.added:
+            print(
+                f"Архив страниц: добавлено {self.added}, из них совпали с уже сохранёнными {self.duplicates}"
+            )
+
+    def save(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        with self.lock:
+            self.save()
+            self.db.close()
@@ -0,0 +1,71 @@
+"""
+Разбор HTML страниц сайта
+
+По умолчанию используется быстрый парсер lxml, и из страницы строятся
+только нужные программе части (блоки лотов в результатах поиска,
+таблица товаров, список вложений), а не всё дерево большой страницы.
+Если lxml не установлен или выбран параметром `--parser html.parser`,
+страница целиком разбирается встроенным парсером Python, как раньше.
+"""
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+except ModuleNotFoundError:
+    FAST_BACKEND = None
+else:
+    FAST_BACKEND = "lxml"
+
+BACKENDS = ["lxml", "html.parser"]
+backend = FAST_BACKEND or "html.parser"
+
+
+def has_class(*names):
+    """Filter for SoupStrainer: element has one of the classes
+
+    При разборе с SoupStrainer атрибут class приходит одной строкой"""
+
+    def check(value):
+        return value is not None and any(c in names for c in value.split())
+
+    return check
+
+
+# части страниц, которые нужны программе
+TARGETS = {
+    "search": SoupStrainer(
+        "div", class_=has_class("search-registry-entry-block", "search-results__total")
+    ),
+    "suppliers": SoupStrainer("div", class_=has_class("cardWrapper")),
+    "goods": SoupStrainer("div", id="positionKTRU"),
+    "attachments": SoupStrainer("div", class_=has_class("attachment")),
+}
+
+
+def set_backend(name):
+    """Choose parser backend: `lxml` or `html.parser`"""
+
+    global backend
+    if name == "lxml" and FAST_BACKEND is None:
+        print("Парсер lxml не установлен, используется html.parser")
+        name = "html.parser"
+    backend = name
+
+
+def decode(content, encoding=None):
+    """Text of the page from bytes of the response (as `Response.text`)"""
+
+    return str(content, encoding or "utf-8", errors="replace")
+
+
+def make_soup(page, target):
+    """Parse the page
+
+    Input: `page` - HTML text, `target` - key of TARGETS, part of the page
+        to build (the whole page is built by `html.parser` backend)
+    Output: BeautifulSoup object"""
+
+    if backend == "html.parser":
+        return BeautifulSoup(page, "html.parser")
+    return BeautifulSoup(page, backend, parse_only=TARGETS[target])
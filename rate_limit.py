@@ -0,0 +1,188 @@
+"""
+Ограничение скорости и количества одновременных запросов к сайту
+
+Перед каждым запросом берётся жетон из ведра (скорость в запросах
+в секунду) и место среди одновременных запросов. Оба предела
+подстраиваются под сайт по схеме AIMD: ответы 429, ошибки 5xx,
+таймауты и обрывы соединения уменьшают их вдвое (не чаще раза
+в секунду), а каждый быстрый успешный ответ понемногу увеличивает,
+пока не будут достигнуты заданные пределы. Ответ медленнее обычного
+для этой страницы пределы не увеличивает. Заголовок Retry-After
+приостанавливает все запросы на указанное сайтом время.
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import metrics
+
+# во сколько раз уменьшаются пределы при ответе 429 или ошибке
+DECREASE = 0.5
+# пределы уменьшаются не чаще, чем раз в столько секунд:
+# ответы на уже отправленные запросы не должны уменьшать их повторно
+DECREASE_INTERVAL = 1.0
+MIN_RATE = 0.5
+# ответ во столько раз медленнее самого быстрого для страницы - медленный
+SLOW_FACTOR = 3.0
+# ... но ответ быстрее этого времени (с) медленным не считается
+SLOW_MIN = 0.5
+# окно (с) для замера фактической скорости запросов
+RATE_WINDOW = 2.0
+# пауза (с) после 429 без заголовка Retry-After
+DEFAULT_RETRY_AFTER = 1.0
+MAX_RETRY_AFTER = 300.0
+
+
+def retry_after(response):
+    """Seconds from the Retry-After header (number or HTTP date) or None"""
+
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            moment = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        delay = (moment - datetime.now(timezone.utc)).total_seconds()
+    return min(max(delay, 0.0), MAX_RETRY_AFTER)
+
+
+def is_throttled(status):
+    """True if the response or the exception means the site is overloaded"""
+
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return isinstance(status, (requests.Timeout, requests.ConnectionError))
+
+
+class RateLimiter:
+    """Token bucket with AIMD adaptive rate and concurrency
+
+    Input: `max_concurrency` - upper limit of simultaneous requests,
+        `max_rate` - upper limit of requests per second (None - without
+        limit until the site starts throttling)"""
+
+    def __init__(self, max_concurrency=1, max_rate=None):
+        self.condition = threading.Condition()
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_rate = max_rate
+        self.concurrency = float(self.max_concurrency)
+        self.rate = float(max_rate) if max_rate else None
+        self.tokens = 1.0
+        self.tokens_time = time.monotonic()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.sent = deque()
+        # самый быстрый ответ по каждой странице сайта
+        self.fastest = {}
+        self.decreases = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def refill(self, now):
+        if self.rate is None:
+            self.tokens = 1.0
+        else:
+            burst = max(1.0, self.rate / 4)
+            self.tokens = min(burst, self.tokens + (now - self.tokens_time) * self.rate)
+        self.tokens_time = now
+
+    def acquire(self):
+        """Wait for a token and a free place among simultaneous requests"""
+
+        started = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                elif self.in_flight >= int(self.concurrency):
+                    # место освободит release
+                    delay = None
+                elif self.tokens < 1:
+                    delay = (1 - self.tokens) / self.rate
+                else:
+                    break
+                self.condition.wait(delay)
+            self.tokens -= 1
+            self.in_flight += 1
+            self.sent.append(now)
+            while self.sent[0] < now - RATE_WINDOW:
+                self.sent.popleft()
+        waited = now - started
+        if waited > 0.001:
+            self.waited += waited
+            metrics.record("limit", "wait", "ok", waited)
+
+    def release(self, endpoint, status, seconds, response=None):
+        """Adapt limits to the result of the request
+
+        Input: `status` - status code of the response or the exception,
+            `seconds` - duration of the request,
+            `response` - the response (for Retry-After)"""
+
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if is_throttled(status):
+                if status in [429, 503] and response is not None:
+                    delay = retry_after(response)
+                    if delay is None and status == 429:
+                        delay = DEFAULT_RETRY_AFTER
+                    if delay:
+                        self.throttled += 1
+                        self.paused_until = max(self.paused_until, now + delay)
+                self.decrease(now, status)
+            elif isinstance(status, int) and status < 400:
+                fastest = min(self.fastest.get(endpoint, seconds), seconds)
+                self.fastest[endpoint] = fastest
+                if seconds <= max(fastest * SLOW_FACTOR, SLOW_MIN):
+                    self.increase()
+            self.condition.notify_all()
+
+    def increase(self):
+        # за круг запросов параллельность растёт на 1, скорость - на 1 в секунду
+        self.concurrency = min(
+            self.max_concurrency, self.concurrency + 1 / self.concurrency
+        )
+        if self.rate is not None:
+            self.rate += 1 / self.rate
+            if self.max_rate:
+                self.rate = min(self.rate, self.max_rate)
+
+    def decrease(self, now, status):
+        if now - self.last_decrease < DECREASE_INTERVAL:
+            return
+        self.last_decrease = now
+        self.decreases += 1
+        # без заданной скорости за основу берётся фактическая
+        rate = self.rate
+        if rate is None:
+            rate = len(self.sent) / RATE_WINDOW
+        self.rate = max(MIN_RATE, rate * DECREASE)
+        self.concurrency = max(1.0, self.concurrency * DECREASE)
+        if not isinstance(status, int):
+            status = type(status).__name__
+        print(
+            f"Сайт ограничивает запросы ({status}): скорость снижена до"
+            f" {self.rate:.1f} запр/с, одновременных запросов {int(self.concurrency)}"
+        )
+
+    def report(self):
+        rate = "без ограничения" if self.rate is None else f"{self.rate:.1f} запр/с"
+        print(
+            f"Ограничение запросов: скорость {rate}, одновременных запросов"
+            f" {int(self.concurrency)} из {self.max_concurrency},"
+            f" снижений {self.decreases}, пауз по 429/Retry-After {self.throttled},"
+            f" ожидание потоков {self.waited:.1f} с"
+        )
@@ -0,0 +1,152 @@
+"""
+Повтор неудачных заданий в том же запуске
+
+Ошибка задания (окна поиска, лота, файла) относится к временным -
+таймаут, обрыв соединения, ответ сайта 5xx или 429 - или к постоянным:
+страница не найдена (4xx), разметка страницы не разобрана. Задание
+с временной ошибкой повторяется в этом же запуске через паузу, которая
+растёт вдвое с каждой попыткой (со случайной добавкой, чтобы потоки
+не повторяли запросы одновременно). Задание с постоянной ошибкой или
+исчерпавшее попытки попадает в список отказов с причиной; основной
+поток записывает его на вкладку `errors`. Страница, которой нет в кэше
+при работе без сайта (`--cache-only`), не повторяется и в отказы
+не записывается: задание выполнит следующий запуск с сайтом.
+"""
+
+import heapq
+import itertools
+import random
+import time
+
+import requests
+
+from http_cache import CACHE_MISS_REASON
+
+# пауза перед первым повтором и наибольшая пауза, с
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+# страницы нет в кэше при работе без сайта: повторять бесполезно
+CACHE_MISS = "cache_miss"
+
+
+class SiteError(Exception):
+    """The site answered with an unexpected status code
+
+    Input: `response` - the response"""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.cache_miss = response.reason == CACHE_MISS_REASON
+        super().__init__(f"Request url {response.url} result {response.status_code}")
+
+
+def classify(error):
+    """Kind of the error: TRANSIENT (worth retrying), PERMANENT
+    or CACHE_MISS"""
+
+    if isinstance(error, SiteError):
+        if error.cache_miss:
+            return CACHE_MISS
+        status = error.status_code
+        return TRANSIENT if status >= 500 or status in [408, 429] else PERMANENT
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return TRANSIENT
+    # соединение оборвалось посреди ответа
+    if isinstance(error, (requests.exceptions.ChunkedEncodingError, ConnectionError)):
+        return TRANSIENT
+    return PERMANENT
+
+
+def backoff(attempt):
+    """Delay before the retry number `attempt` (from 1), with jitter"""
+
+    delay = min(MAX_DELAY, BASE_DELAY * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class RetryQueue:
+    """Items waiting for the retry and the list of failed items
+
+    Used by the main thread only
+
+    Input: `stage` - stage name for the list of failures,
+        `retries` - how many times an item with transient error is retried"""
+
+    def __init__(self, stage, retries):
+        self.stage = stage
+        self.retries = retries
+        self.attempts = {}
+        self.waiting = []
+        self.counter = itertools.count()
+        self.retried = 0
+        self.missed = 0
+        # отказы: dict с полями вкладки `errors`
+        self.dead = []
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def failed(self, key, item, error):
+        """Schedule the retry of the failed item
+
+        Input: `key` - text naming the item, `item` - the item to return
+            from `due` later, `error` - the exception
+        Output: True if the item will be retried, False if it is failed"""
+
+        kind = classify(error)
+        if kind == CACHE_MISS:
+            # задание выполнится при запуске с сайтом, в отказы оно не пишется
+            self.missed += 1
+            return False
+        attempt = self.attempts.get(key, 0) + 1
+        self.attempts[key] = attempt
+        if kind == TRANSIENT and attempt <= self.retries:
+            delay = backoff(attempt)
+            print(
+                f"Ошибка ({key}): {error}. Повтор через {delay:.1f} с, попытка {attempt} из {self.retries}"
+            )
+            heapq.heappush(
+                self.waiting, (time.monotonic() + delay, next(self.counter), item)
+            )
+            self.retried += 1
+            return True
+
+        print(f"Не удалось выполнить ({key}): {error}")
+        self.dead.append(
+            {
+                "stage": self.stage,
+                "item": key,
+                "kind": kind,
+                "attempts": attempt,
+                "cause": f"{type(error).__name__}: {error}",
+            }
+        )
+        return False
+
+    def due(self):
+        """Items whose retry time has come"""
+
+        now = time.monotonic()
+        items = []
+        while self.waiting and self.waiting[0][0] <= now:
+            items.append(heapq.heappop(self.waiting)[2])
+        return items
+
+    def timeout(self, limit=None):
+        """Seconds until the next retry (not more than `limit`) or `limit`"""
+
+        if not self.waiting:
+            return limit
+        delay = max(0.0, self.waiting[0][0] - time.monotonic())
+        return delay if limit is None else min(delay, limit)
+
+    def report(self):
+        if self.retried or self.dead:
+            print(
+                f"Повторов после временных ошибок: {self.retried}, не выполнено: {len(self.dead)}"
+            )
+        if self.missed:
+            print(f"Не выполнено из-за отсутствия страниц в кэше: {self.missed}")
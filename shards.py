@@ -0,0 +1,54 @@
+"""
+Разделение работы между независимыми запусками (шардами)
+
+Запуск с `--shard K/N` выполняет K-ю из N частей работы: задания поиска
+делятся по ИНН и году, обновление - по ИНН, лоты этапов 2 и 3 - по
+реестровому номеру. Часть определяется контрольной суммой ключа, поэтому
+на любой машине ключ попадает в одну и ту же часть. Каждый шард работает
+со своими файлами (`zakupki.2of4.xlsx`, `zakupki.2of4.cache`, ...),
+команда `merge` собирает их в общий файл.
+"""
+
+import argparse
+import glob
+import os
+import re
+import zlib
+
+
+def parse_shard(text):
+    """Shard `K/N` of the command line as (K, N)"""
+
+    match = re.fullmatch(r"(\d+)/(\d+)", text.strip())
+    if not match or not 1 <= int(match[1]) <= int(match[2]):
+        raise argparse.ArgumentTypeError(
+            f"ожидается номер шарда и количество шардов K/N, 1 <= K <= N: {text}"
+        )
+    return int(match[1]), int(match[2])
+
+
+def shard_name(file_name, shard):
+    """Name of the file of the shard: `zakupki.xlsx` -> `zakupki.2of4.xlsx`"""
+
+    stem, ext = os.path.splitext(file_name)
+    return f"{stem}.{shard[0]}of{shard[1]}{ext}"
+
+
+def shard_of(key, count):
+    """Number of the shard (from 1) of the key among `count` shards"""
+
+    return zlib.crc32(str(key).encode()) % count + 1
+
+
+def find_shards(file_name):
+    """Files of all shards of `file_name` in the folder of it,
+    ordered by number of shards and the shard number"""
+
+    stem, ext = os.path.splitext(file_name)
+    pattern = re.compile(re.escape(stem) + r"\.(\d+)of(\d+)" + re.escape(ext) + "$")
+    found = []
+    for name in glob.glob(glob.escape(stem) + ".*of*" + glob.escape(ext)):
+        match = pattern.match(name)
+        if match:
+            found.append((int(match[2]), int(match[1]), name))
+    return [name for _, _, name in sorted(found)]
@@ -0,0 +1,464 @@
+"""
+Хранение данных программы в базе SQLite
+
+База `zakupki.db` может быть рабочим хранилищем вместо `zakupki.xlsx`:
+запуск читает и записывает только те строки, которые ему нужны.
+Листы `log`, `jobs`, `lots`, `refresh`, `suppliers`, `goods` и `errors` становятся
+таблицами, участники и товары лота хранятся строками таблиц `suppliers`
+и `goods` с номером лота `lot_ID`. Excel файл для аналитиков выгружается командой `export`,
+удалённые ими лоты и отметки `stage3=yes` загружаются командой `import`.
+"""
+
+import json
+import os
+import re
+import sqlite3
+from datetime import date, datetime
+
+import openpyxl
+
+# таблица -> {колонка: тип}; прочие поля записи хранятся в колонке extra
+SCHEMA = {
+    "log": {},
+    "jobs": {
+        "state": "text",
+        "INN": "text",
+        "year": "int",
+        "month": "int",
+    },
+    "lots": {
+        "stage2": "text",
+        "stage3": "text",
+        "fz": "text",
+        "subtype": "text",
+        "link": "text",
+        "number": "text",
+        "stage": "text",
+        "name": "text",
+        "agency_link": "text",
+        "agency": "text",
+        "price": "real",
+        "published": "date",
+        "updated": "date",
+        "last_date": "date",
+        "customer": "text",
+    },
+    "refresh": {
+        "INN": "text",
+        "updated": "date",
+    },
+    "errors": {
+        "stage": "text",
+        "item": "text",
+        "kind": "text",
+        "attempts": "int",
+        "cause": "text",
+    },
+}
+
+INDEXES = {
+    "jobs": [("INN", "year", "month"), ("state",)],
+    "lots": [("number",), ("stage2",), ("stage3",)],
+    "refresh": [("INN",)],
+}
+
+SQL_TYPES = {"text": "TEXT", "int": "INTEGER", "real": "REAL", "date": "TEXT"}
+
+
+class ChildTable:
+    """Numbered rows of the lot kept in the record as `prefix{n}_{field}`
+
+    Input: `name` - table name, `key_format` - record key for (n, field),
+        `key_pattern` - regexp to recognize the record key, `fields` - columns"""
+
+    def __init__(self, name, key_format, key_pattern, fields):
+        self.name = name
+        self.key_format = key_format
+        self.key_pattern = re.compile(key_pattern)
+        self.fields = fields
+
+    def key(self, n, field):
+        return self.key_format.format(n=n, field=field)
+
+    def match(self, key):
+        match = self.key_pattern.fullmatch(key)
+        if match is None or match[2] not in self.fields:
+            return None
+        return int(match[1]), match[2]
+
+
+CHILDREN = {
+    "lots": [
+        ChildTable(
+            "suppliers",
+            "supplier{n}_{field}",
+            r"supplier(\d+)_(\w+)",
+            ["name", "status", "price"],
+        ),
+        ChildTable(
+            "goods",
+            "good_{n:02d}_{field}",
+            r"good_(\d+)_(\w+)",
+            ["KTRU", "name", "count", "price", "value"],
+        ),
+    ],
+}
+
+
+def split_record(name, record):
+    """Split the record into own fields and numbered rows of child tables
+
+    Output: (dict of own fields, {child table name: {n: dict of fields}})"""
+
+    fields = {}
+    children = {child.name: {} for child in CHILDREN.get(name, [])}
+    for key, value in record.items():
+        for child in CHILDREN.get(name, []):
+            found = child.match(key)
+            if found is not None:
+                n, field = found
+                children[child.name].setdefault(n, {})[field] = value
+                break
+        else:
+            fields[key] = value
+    return fields, children
+
+
+def to_json(values):
+    """Serialize dict with dates and datetimes to JSON"""
+
+    def default(value):
+        if isinstance(value, datetime):
+            return {"$datetime": value.isoformat()}
+        if isinstance(value, date):
+            return {"$date": value.isoformat()}
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+    return json.dumps(values, ensure_ascii=False, default=default)
+
+
+def from_json(text):
+    def hook(value):
+        if "$datetime" in value:
+            return datetime.fromisoformat(value["$datetime"])
+        if "$date" in value:
+            return date.fromisoformat(value["$date"])
+        return value
+
+    return json.loads(text, object_hook=hook)
+
+
+def encode(kind, value):
+    if value is None or kind != "date":
+        return value
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat()
+
+
+def decode(kind, value):
+    if value is None or kind != "date":
+        return value
+    return date.fromisoformat(value)
+
+
+class SQLiteTable:
+    """Table of the database with the same interface as WSWrapper
+
+    Records are addressed by position in the order of `ID`"""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.db = store.db
+        self.name = name
+        self.columns = SCHEMA[name]
+        self.children = CHILDREN.get(name, [])
+        self.ids = [
+            ID for (ID,) in self.db.execute(f"SELECT ID FROM {name} ORDER BY ID")
+        ]
+        self.new_ID = self.ids[-1] + 1 if self.ids else 1
+
+        names = ", ".join(["ID", *(f'"{c}"' for c in self.columns), "extra"])
+        marks = ", ".join("?" * (len(self.columns) + 2))
+        self.select_sql = f"SELECT {names} FROM {name} WHERE ID = ?"
+        self.insert_sql = f"INSERT OR REPLACE INTO {name} ({names}) VALUES ({marks})"
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self.ids):
+            raise KeyError
+        return self.read(self.ids[index])
+
+    def __setitem__(self, index, record):
+        """Change the fields of the record given in `record`
+
+        Child rows are rewritten only for child tables with fields in
+        `record`, the other rows and columns are not touched"""
+
+        if index >= len(self.ids):
+            raise KeyError
+        ID = self.ids[index]
+        fields, children = split_record(self.name, record)
+        fields.pop("ID", None)
+        columns = [name for name in fields if name in self.columns]
+        if columns:
+            assignments = ", ".join(f'"{name}" = ?' for name in columns)
+            self.db.execute(
+                f"UPDATE {self.name} SET {assignments} WHERE ID = ?",
+                (*(encode(self.columns[c], fields[c]) for c in columns), ID),
+            )
+        extra = {key: value for key, value in fields.items() if key not in columns}
+        if extra:
+            (text,) = self.db.execute(
+                f"SELECT extra FROM {self.name} WHERE ID = ?", (ID,)
+            ).fetchone()
+            extra = {**(from_json(text) if text else {}), **extra}
+            self.db.execute(
+                f"UPDATE {self.name} SET extra = ? WHERE ID = ?", (to_json(extra), ID)
+            )
+        for child in self.children:
+            if children[child.name]:
+                self.write_children(child, ID, children[child.name])
+        self.store.changed()
+
+    def replace(self, index, record):
+        """Write the whole record: columns and child rows missing in
+        `record` are cleared"""
+
+        if index >= len(self.ids):
+            raise KeyError
+        self.write(self.ids[index], record)
+
+    def column(self, name):
+        """Values of the column for all records"""
+
+        if name == "ID":
+            return list(self.ids)
+        if name in self.columns:
+            kind = self.columns[name]
+            return [
+                decode(kind, value)
+                for (value,) in self.db.execute(
+                    f'SELECT "{name}" FROM {self.name} ORDER BY ID'
+                )
+            ]
+        return [self.read(ID).get(name) for ID in self.ids]
+
+    def append(self, record):
+        ID = self.new_ID
+        self.new_ID += 1
+        self.ids.append(ID)
+        self.write(ID, record)
+
+    def read(self, ID):
+        row = self.db.execute(self.select_sql, (ID,)).fetchone()
+        record = {"ID": ID}
+        for (name, kind), value in zip(self.columns.items(), row[1:-1]):
+            record[name] = decode(kind, value)
+        if row[-1]:
+            record.update(from_json(row[-1]))
+        for child in self.children:
+            fields = ", ".join(f'"{f}"' for f in child.fields)
+            for n, *values in self.db.execute(
+                f"SELECT n, {fields} FROM {child.name} WHERE lot_ID = ? ORDER BY n",
+                (ID,),
+            ):
+                for field, value in zip(child.fields, values):
+                    record[child.key(n, field)] = value
+        return record
+
+    def write(self, ID, record):
+        fields, children = split_record(self.name, record)
+        extra = {
+            key: value
+            for key, value in fields.items()
+            if key != "ID" and key not in self.columns
+        }
+
+        values = [encode(kind, record.get(name)) for name, kind in self.columns.items()]
+        self.db.execute(
+            self.insert_sql, (ID, *values, to_json(extra) if extra else None)
+        )
+        for child in self.children:
+            self.write_children(child, ID, children[child.name])
+        self.store.changed()
+
+    def write_children(self, child, ID, rows):
+        """Replace rows of the child table of the record with `rows`
+
+        Input: `rows` - {n: dict of fields}"""
+
+        self.db.execute(f"DELETE FROM {child.name} WHERE lot_ID = ?", (ID,))
+        fields = ", ".join(f'"{f}"' for f in child.fields)
+        marks = ", ".join("?" * (len(child.fields) + 2))
+        self.db.executemany(
+            f"INSERT INTO {child.name} (lot_ID, n, {fields}) VALUES ({marks})",
+            [
+                (ID, n, *(row.get(f) for f in child.fields))
+                for n, row in sorted(rows.items())
+            ],
+        )
+
+    def delete(self, ids):
+        ids = set(ids)
+        params = [(ID,) for ID in ids]
+        self.db.executemany(f"DELETE FROM {self.name} WHERE ID = ?", params)
+        for child in self.children:
+            self.db.executemany(f"DELETE FROM {child.name} WHERE lot_ID = ?", params)
+        self.ids = [ID for ID in self.ids if ID not in ids]
+        self.store.changed()
+
+
+class SQLiteStore:
+    """Working store of the program in SQLite database
+
+    Input: `file_name` - database file, it is created if it does not exist"""
+
+    # изменения фиксируются в базе пачками
+    COMMIT_EVERY = 200
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.db = sqlite3.connect(file_name)
+        self.tables = {}
+        self.uncommitted = 0
+        self.create_schema()
+
+    def create_schema(self):
+        for name, columns in SCHEMA.items():
+            definition = "".join(
+                f', "{c}" {SQL_TYPES[kind]}' for c, kind in columns.items()
+            )
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} "
+                f"(ID INTEGER PRIMARY KEY{definition}, extra TEXT)"
+            )
+            for index in INDEXES.get(name, []):
+                self.db.execute(
+                    f"CREATE INDEX IF NOT EXISTS {name}_{'_'.join(index)} "
+                    f"ON {name} ({', '.join(index)})"
+                )
+            for child in CHILDREN.get(name, []):
+                fields = "".join(f', "{f}" TEXT' for f in child.fields)
+                self.db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {child.name} "
+                    f"(lot_ID INTEGER, n INTEGER{fields}, PRIMARY KEY (lot_ID, n))"
+                )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.db.commit()
+
+    def get_wrapper(self, name, position=None):
+        if name not in self.tables:
+            self.tables[name] = SQLiteTable(self, name)
+        return self.tables[name]
+
+    def get_meta(self, name, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,))
+        row = row.fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_meta(self, name, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, json.dumps(value))
+        )
+        self.changed()
+
+    def changed(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.COMMIT_EVERY:
+            self.save()
+
+    def save(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.save()
+        self.db.close()
+
+
+def export_workbook(store, file_name):
+    """Write sheets `log`, `jobs`, `lots`, `refresh`, `suppliers` and `goods`
+    from the store to Excel file
+
+    Other sheets of the existing file are kept"""
+
+    if os.path.exists(file_name):
+        wb = openpyxl.open(file_name)
+    else:
+        wb = openpyxl.Workbook()
+        wb.remove(wb.active)
+
+    sheets = {}
+    for name in SCHEMA:
+        table = store.get_wrapper(name)
+        # строки участников и товаров выгружаются на свои листы
+        sheets[name] = [split_record(name, table[i])[0] for i in range(len(table))]
+    for children in CHILDREN.values():
+        for child in children:
+            fields = ", ".join(f'"{f}"' for f in child.fields)
+            rows = store.db.execute(
+                f"SELECT lot_ID, n, {fields} FROM {child.name} ORDER BY lot_ID, n"
+            )
+            sheets[child.name] = [
+                dict(zip(["ID", "lot_ID", "n", *child.fields], [ID, *row]))
+                for ID, row in enumerate(rows, 1)
+            ]
+
+    for position, (name, records) in enumerate(sheets.items()):
+        if name in wb:
+            position = wb.sheetnames.index(name)
+            wb.remove(wb[name])
+        ws = wb.create_sheet(name, position)
+
+        names = {"ID": None}
+        for record in records:
+            names.update(dict.fromkeys(record))
+        ws.append(list(names))
+        for record in records:
+            ws.append([record.get(n) for n in names])
+        print(f"Лист {name}: выгружено записей {len(records)}")
+
+    lots = store.get_wrapper("lots")
+    # лоты, добавленные после выгрузки, не будут удалены при загрузке
+    store.set_meta("exported_lot_ID", lots.ids[-1] if lots.ids else 0)
+    wb.save(file_name)
+
+
+def import_workbook(store, file_name):
+    """Read deleted lots and `stage3` marks from the `lots` sheet of Excel file"""
+
+    wb = openpyxl.open(file_name, read_only=True)
+    if "lots" not in wb:
+        print(f"В файле {file_name} нет листа lots")
+        return
+
+    rows = wb["lots"].iter_rows(values_only=True)
+    header = list(next(rows, []))
+    if "ID" not in header or "stage3" not in header:
+        print(f"На листе lots файла {file_name} нет колонок ID и stage3")
+        return
+    id_col = header.index("ID")
+    stage3_col = header.index("stage3")
+    marks = {}
+    for row in rows:
+        if row[id_col] is not None:
+            marks[int(row[id_col])] = row[stage3_col]
+    wb.close()
+
+    exported = store.get_meta("exported_lot_ID", 0)
+    lots = store.get_wrapper("lots")
+    current = dict(store.db.execute("SELECT ID, stage3 FROM lots"))
+    deleted = [ID for ID in lots.ids if ID not in marks and ID <= exported]
+    lots.delete(deleted)
+
+    marked = 0
+    for index, ID in enumerate(lots.ids):
+        if marks.get(ID) == "yes" and current[ID] not in ["yes", "done"]:
+            lots[index] = {"stage3": "yes"}
+            marked += 1
+    print(f"Удалено лотов: {len(deleted)}, отмечено для этапа 3: {marked}")
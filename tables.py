@@ -0,0 +1,430 @@
+"""
+Табличное представление листов Excel файла
+
+Лист читается целиком один раз (`iter_rows(values_only=True)`),
+строки хранятся в памяти списками значений, а в лист при сохранении
+записываются только изменённые ячейки.
+
+Участники и товары лота хранятся строками листов `suppliers` и `goods`
+с номером лота `lot_ID`, а не колонками строки лота: иначе лот с сотней
+товаров добавляет всему листу `lots` сотни почти пустых колонок.
+"""
+
+import weakref
+from datetime import date, datetime
+
+import openpyxl
+
+from storage import CHILDREN, SQLiteStore, split_record
+
+# книга -> {имя листа: WSWrapper}, чтобы на один лист был один wrapper
+wrappers = weakref.WeakKeyDictionary()
+# книга -> Journal её изменений
+journals = weakref.WeakKeyDictionary()
+# места листов программы в книге
+SHEET_POSITIONS = {
+    "log": 0,
+    "jobs": 1,
+    "lots": 2,
+    "refresh": 3,
+    "suppliers": 4,
+    "goods": 5,
+    "errors": 6,
+}
+
+
+class WSWrapper:
+    """Worksheet as a list of records (dicts) with column `ID`
+
+    Input: `ws` - openpyxl worksheet, the first row holds column names"""
+
+    __slots__ = (
+        "ws",
+        "names",
+        "name_to_index",
+        "rows",
+        "new_ID",
+        "dirty",
+        "stored",
+        "journal",
+    )
+
+    def __init__(self, ws):
+        self.ws = ws
+        # Journal, в который пишутся все изменения, или None
+        self.journal = None
+        # строка (индекс записи) -> множество изменённых колонок
+        self.dirty = {}
+
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if ws.max_column <= 1 and ws.max_row <= 1 and (not header or not header[0]):
+            self.names = ["ID"]
+            self.name_to_index = {"ID": 0}
+            self.rows = []
+            self.stored = 0
+            self.new_ID = 1
+            self.dirty[-1] = {0}
+            return
+
+        self.names = list(header)
+        self.name_to_index = {name: i for i, name in enumerate(self.names)}
+        self.rows = [list(row) for row in rows]
+        # количество строк, которые уже есть на листе
+        self.stored = len(self.rows)
+        self.new_ID = 1
+        for row in self.rows:
+            if row[0] is not None:
+                self.new_ID = max(self.new_ID, 1 + int(row[0]))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self.rows):
+            raise KeyError
+        row = self.rows[index]
+        if len(row) < len(self.names):
+            row.extend([None] * (len(self.names) - len(row)))
+        return dict(zip(self.names, row))
+
+    def __setitem__(self, index, record):
+        if index >= len(self.rows):
+            raise KeyError
+        changes = self.update(index, record)
+        if self.journal is not None and changes:
+            self.journal.write(self.ws.title, self.rows[index][0], changes)
+
+    def update(self, index, record):
+        """Change values of the row, output: dict of changed values"""
+
+        row = self.rows[index]
+        changed = self.dirty.setdefault(index, set())
+        changes = {}
+        for name, value in record.items():
+            col = self.name_to_index.get(name)
+            if col is None:
+                col = len(self.names)
+                self.names.append(name)
+                self.name_to_index[name] = col
+                self.dirty.setdefault(-1, set()).add(col)
+            if col >= len(row):
+                row.extend([None] * (col + 1 - len(row)))
+            if row[col] != value or index >= self.stored:
+                row[col] = value
+                changed.add(col)
+                changes[name] = value
+        return changes
+
+    def column(self, name):
+        """Values of the column for all records"""
+
+        col = self.name_to_index.get(name)
+        if col is None:
+            return [None] * len(self.rows)
+        return [row[col] if col < len(row) else None for row in self.rows]
+
+    def append(self, record, ID=None):
+        if ID is None:
+            ID = self.new_ID
+        self.new_ID = max(self.new_ID, ID + 1)
+        self.rows.append([ID])
+        self.update(len(self.rows) - 1, record)
+        if self.journal is not None:
+            self.journal.write(self.ws.title, ID, record, new=True)
+
+    def drop_columns(self, names):
+        """Remove the columns from the worksheet and the records"""
+
+        cols = sorted(self.name_to_index[name] for name in names)
+        if not cols:
+            return
+        # изменения пишутся в лист, пока номера колонок прежние
+        self.flush()
+        # подряд идущие колонки удаляются из листа за один раз, с конца
+        ranges = []
+        for col in cols:
+            if ranges and ranges[-1][0] + ranges[-1][1] == col:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([col, 1])
+        for col, amount in reversed(ranges):
+            self.ws.delete_cols(col + 1, amount)
+        for col in reversed(cols):
+            del self.names[col]
+            for row in self.rows:
+                if col < len(row):
+                    del row[col]
+        self.name_to_index = {name: i for i, name in enumerate(self.names)}
+
+    def flush(self):
+        """Write changed cells and new rows to the worksheet"""
+
+        ws = self.ws
+        for col in sorted(self.dirty.pop(-1, ())):
+            ws.cell(1, col + 1).value = self.names[col]
+        for index, cols in sorted(self.dirty.items()):
+            row = self.rows[index]
+            if index >= self.stored:
+                # новые строки дописываются в конец листа целиком
+                ws.append(row)
+                continue
+            for col in cols:
+                ws.cell(index + 2, col + 1).value = row[col]
+        self.dirty = {}
+        self.stored = len(self.rows)
+
+
+class KeyedTable:
+    """Table (WSWrapper or SQLiteTable) with hash index of records by key
+
+    Input: `table` - the table, `fields` - names of key columns,
+        `make_key` - function to normalize tuple of key values"""
+
+    def __init__(self, table, fields, make_key=tuple):
+        self.table = table
+        self.fields = fields
+        self.make_key = make_key
+        self.index = {}
+        columns = [table.column(name) for name in fields]
+        for i, values in enumerate(zip(*columns)):
+            self.index.setdefault(make_key(values), i)
+
+    def key(self, record):
+        return self.make_key(tuple(record.get(name) for name in self.fields))
+
+    def find(self, record):
+        """Position of the record with the same key or None"""
+
+        return self.index.get(self.key(record))
+
+    def append(self, record):
+        self.table.append(record)
+        self.index.setdefault(self.key(record), len(self.table) - 1)
+
+    def upsert(self, record, fields):
+        """Append the record or update `fields` of the record with its key
+
+        Output: "new", "updated" or "same" """
+
+        i = self.find(record)
+        if i is None:
+            self.append(record)
+            return "new"
+        current = self.table[i]
+        changes = {
+            name: record[name]
+            for name in fields
+            if name in record and not same_value(current.get(name), record[name])
+        }
+        if not changes:
+            return "same"
+        self.table[i] = changes
+        return "updated"
+
+
+class LotDetails:
+    """Writer of lot records which keeps numbered rows of the lot
+    (`supplier1_name`, `good_01_KTRU`, ...) on the sheets of child tables
+
+    The SQLite store splits records itself, they replace the whole
+    record there
+
+    Input: `wb` - workbook or SQLiteStore"""
+
+    def __init__(self, wb):
+        # имя листа -> (таблица, {lot_ID: индексы строк лота}, пустые строки)
+        self.sheets = {}
+        if isinstance(wb, SQLiteStore):
+            return
+        for child in CHILDREN["lots"]:
+            table = get_wrapper(wb, child.name, SHEET_POSITIONS[child.name])
+            rows = {}
+            free = []
+            for i, lot_ID in enumerate(table.column("lot_ID")):
+                if lot_ID is None:
+                    free.append(i)
+                else:
+                    rows.setdefault(lot_ID, []).append(i)
+            # пустые строки занимаются раньше, чем дописываются новые,
+            # верхние - первыми
+            free.reverse()
+            self.sheets[child.name] = (table, rows, free)
+
+    def write(self, lots, index, record):
+        """Write the record (with `ID`) to the `lots` table at `index`"""
+
+        if not self.sheets:
+            lots.replace(index, record)
+            return
+        fields, children = split_record("lots", record)
+        lots[index] = fields
+        ID = record["ID"]
+        for name, (table, rows, free) in self.sheets.items():
+            new = [
+                {"lot_ID": ID, "n": n, **row}
+                for n, row in sorted(children[name].items())
+            ]
+            old = rows.get(ID, [])
+            kept = min(len(old), len(new))
+            for i, row in zip(old, new):
+                table[i] = row
+            for i in old[kept:]:
+                # лишние строки прошлого сбора очищаются и занимаются потом
+                table[i] = {column: None for column in table.names if column != "ID"}
+                free.append(i)
+            # первой занимается верхняя пустая строка
+            free.sort(reverse=True)
+            indexes = old[:kept]
+            for row in new[kept:]:
+                if free:
+                    i = free.pop()
+                    table[i] = row
+                else:
+                    table.append(row)
+                    i = len(table) - 1
+                indexes.append(i)
+            rows[ID] = indexes
+
+
+def migrate_wide_columns(wb):
+    """Move suppliers and goods which earlier versions kept in columns
+    of the `lots` sheet (`supplier1_name`, `good_01_KTRU`, ...) to the
+    sheets of child tables and remove these columns
+
+    Output: number of lots whose rows are moved"""
+
+    if isinstance(wb, SQLiteStore) or "lots" not in wb:
+        return 0
+    lots = get_wrapper(wb, "lots", SHEET_POSITIONS["lots"])
+    legacy = [
+        name
+        for name in lots.names
+        if isinstance(name, str)
+        and any(child.match(name) for child in CHILDREN["lots"])
+    ]
+    if not legacy:
+        return 0
+    details = LotDetails(wb)
+    moved = 0
+    for i in range(len(lots)):
+        record = lots[i]
+        # у лота, собранного заново, строки уже на листах дочерних таблиц,
+        # а в колонках - устаревшие значения
+        if any(record["ID"] in rows for _, rows, _ in details.sheets.values()):
+            continue
+        wide = {name: record[name] for name in legacy if record[name] is not None}
+        if wide:
+            details.write(lots, i, {"ID": record["ID"], **wide})
+            moved += 1
+    lots.drop_columns(legacy)
+    return moved
+
+
+def lot_details(wb):
+    """Suppliers and goods of all lots from the child sheets
+
+    Records of SQLiteStore already hold them, for it the dict is empty
+    Output: {lot ID: {`supplier1_name`: ..., `good_01_KTRU`: ..., ...}}"""
+
+    details = {}
+    if isinstance(wb, SQLiteStore):
+        return details
+    for child in CHILDREN["lots"]:
+        table = get_wrapper(wb, child.name, SHEET_POSITIONS[child.name])
+        for i in range(len(table)):
+            row = table[i]
+            if row.get("lot_ID") is None:
+                continue
+            wide = details.setdefault(row["lot_ID"], {})
+            for field in child.fields:
+                wide[child.key(int(row["n"]), field)] = row.get(field)
+    return details
+
+
+def export_wide(wb, file_name):
+    """Write lots with suppliers and goods in columns of the lot row
+    to a new Excel file
+
+    Input: `wb` - workbook or SQLiteStore, `file_name` - the new file"""
+
+    details = lot_details(wb)
+    lots = get_wrapper(wb, "lots", SHEET_POSITIONS["lots"])
+    records = []
+    names = {"ID": None}
+    for i in range(len(lots)):
+        record = lots[i]
+        record.update(details.get(record["ID"], {}))
+        records.append(record)
+        names.update(dict.fromkeys(record))
+
+    # новый файл пишется потоком, без хранения ячеек в памяти
+    out = openpyxl.Workbook(write_only=True)
+    ws = out.create_sheet("lots")
+    ws.append(list(names))
+    for record in records:
+        ws.append([record.get(name) for name in names])
+    out.save(file_name)
+    print(f"Выгружено лотов: {len(records)}, колонок: {len(names)}")
+
+
+def same_value(a, b):
+    # openpyxl читает даты из файла как datetime
+    if isinstance(a, datetime) and isinstance(b, date) and not isinstance(b, datetime):
+        a = a.date()
+    return a == b
+
+
+def get_wrapper(wb, sheet_name, position):
+    if isinstance(wb, SQLiteStore):
+        return wb.get_wrapper(sheet_name, position)
+    sheets = wrappers.setdefault(wb, {})
+    if sheet_name not in sheets:
+        if sheet_name in wb:
+            sheet = wb[sheet_name]
+        else:
+            sheet = wb.create_sheet(sheet_name, position)
+        sheets[sheet_name] = WSWrapper(sheet)
+        sheets[sheet_name].journal = journals.get(wb)
+    return sheets[sheet_name]
+
+
+def attach_journal(wb, journal):
+    """Apply entries of the journal to the sheets, then log changes to it
+
+    Output: number of applied entries"""
+
+    entries = journal.entries()
+    positions = {}
+    skipped = 0
+    for entry in entries:
+        wrapper = get_wrapper(wb, entry["sheet"], SHEET_POSITIONS.get(entry["sheet"]))
+        if wrapper not in positions:
+            positions[wrapper] = {row[0]: i for i, row in enumerate(wrapper.rows)}
+        index = positions[wrapper].get(entry["ID"])
+        if index is None:
+            if not entry.get("new"):
+                # строку удалил пользователь, изменение без ключевых полей
+                # не должно вернуть её неполной
+                skipped += 1
+                continue
+            wrapper.append(entry["record"], entry["ID"])
+            positions[wrapper][entry["ID"]] = len(wrapper) - 1
+        else:
+            wrapper.update(index, entry["record"])
+
+    journals[wb] = journal
+    for wrapper in wrappers.get(wb, {}).values():
+        wrapper.journal = journal
+    return len(entries) - skipped
+
+
+def save_workbook(wb, file_name):
+    """Flush all wrappers of the workbook and save it"""
+
+    if isinstance(wb, SQLiteStore):
+        wb.save()
+        return
+    for wrapper in wrappers.get(wb, {}).values():
+        wrapper.flush()
+    wb.save(file_name)
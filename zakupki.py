@@ -12,32 +12,116 @@ TODO
 
 import sys
 import os
+import atexit
 import os.path
 import re
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import calendar
+import itertools
 import argparse
 import json
+import threading
+import time
+import multiprocessing
+import shutil
+from collections import deque
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+from urllib.parse import urlsplit
+
+import metrics
+from blacklist import Blacklist, read_patterns
+from file_store import FileStore
+from lot_index import has_work, read_index, write_index
+from page_archive import PageArchive, unpack
+from shards import find_shards, parse_shard, shard_name, shard_of
 
-try:
-    import openpyxl
-    import requests
-    from bs4 import BeautifulSoup
-except ModuleNotFoundError:
-    print(
-        """Ошибка загрузки модуля.
-        Выполните команду:
-        python -m pip install -r requirements.txt"""
-    )
-    raise
+MAIN_FILE_NAME = "zakupki.xlsx"
+DB_FILE_NAME = "zakupki.db"
+CACHE_FILE_NAME = "zakupki.cache"
+ARCHIVE_FILE_NAME = "zakupki.archive"
+JOURNAL_SUFFIX = ".journal"
+INDEX_SUFFIX = ".index"
+WIDE_FILE_NAME = "zakupki_wide.xlsx"
+STORE_DIR_NAME = "zakupki.files"
+SITE_URL = "https://zakupki.gov.ru"
+# адрес сайта, может быть заменён параметром --base-url
+base_url = SITE_URL
+RECORDS_PER_PAGE = 50  # лотов на странице результатов поиска
+CHUNK_SIZE = 256 * 1024
+REPORT_INTERVAL = 2  # секунд между сообщениями о ходе скачивания
+# лоты ищутся по 44-ФЗ и 223-ФЗ, раньше этой даты их нет
+SEARCH_FIRST_DATE = date(2014, 1, 1)
+# сколько раз повторять задание с временной ошибкой сайта в том же запуске
+RETRIES = 3
+# поля лота, которые обновляются при повторном поиске
+LOT_UPDATE_FIELDS = ["stage", "price", "updated", "last_date"]
+blacklist = Blacklist()
+# парсеры HTML, как parsing.BACKENDS (parsing загружается только при работе)
+PARSERS = ["lxml", "html.parser"]
+# пул процессов разбора страниц, создаётся в main
+parser_pool = None
+# (K, N) - запуск выполняет K-ю из N частей работы, None - всю работу
+shard = None
+# состояния заданий и этапов лотов по полноте: при слиянии файлов шардов
+# остаётся более полное
+JOB_RANK = {"pending": 1, "error": 2, "done": 3}
+STAGE2_RANK = {"none": 1, "error": 2, "no_law": 3, "done": 4}
+STAGE3_RANK = {"no": 1, "yes": 2, "done": 3}
+
+
+def import_modules():
+    """Import modules for work with the workbook and the site
+
+    Их загрузка заметно дольше запуска программы, поэтому они загружаются,
+    только когда работа есть"""
+
+    global openpyxl, http_client, parsing, decode, make_soup, Journal
+    global SQLiteStore, export_workbook, import_workbook
+    global KeyedTable, LotDetails, attach_journal, export_wide, get_wrapper
+    global lot_details, migrate_wide_columns
+    global same_value, save_workbook, RetryQueue, SiteError, split_record
+    try:
+        import openpyxl
+
+        import http_client
+        import parsing
+        from journal import Journal
+        from parsing import decode, make_soup
+        from retry import RetryQueue, SiteError
+        from storage import SQLiteStore, export_workbook, import_workbook, split_record
+        from tables import (
+            KeyedTable,
+            LotDetails,
+            attach_journal,
+            export_wide,
+            get_wrapper,
+            lot_details,
+            migrate_wide_columns,
+            same_value,
+            save_workbook,
+        )
+    except ModuleNotFoundError:
+        print("""Ошибка загрузки модуля.
+            Выполните команду:
+            python -m pip install -r requirements.txt""")
+        raise
 
-from bad_list import bad_list
 
-MAIN_FILE_NAME = "zakupki.xlsx"
-headers = {
-    "user-agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:97.0) Gecko/20100101 Firefox/97.0",
-}
-base_url = "https://zakupki.gov.ru"
+def nothing_to_do(args, main_file):
+    """True if the index of the workbook shows the stage has no work"""
+
+    if args.storage == "sqlite" or args.inn and args.stage in [1, "auto"]:
+        return False
+    if os.path.exists(main_file + JOURNAL_SUFFIX):
+        # журнал незавершённого запуска надо применить к файлу
+        return False
+    index = read_index(main_file + INDEX_SUFFIX, main_file)
+    return index is not None and not has_work(index, args.stage)
 
 
 def main():
@@ -49,17 +133,115 @@ def main():
 
     args = command_line_processing()
 
-    if os.path.exists(MAIN_FILE_NAME):
-        print(f"Файл {MAIN_FILE_NAME} найден, он будет дополнен")
-        wb = openpyxl.open(MAIN_FILE_NAME)
-    else:
+    if args.profile:
+        # профиль записывается при выходе, даже если работа прервана ошибкой
+        profiler = metrics.Profiler()
+        profiler.start()
+        atexit.register(profiler.dump, args.profile)
+    if args.metrics:
+        run_info = {
+            "Date time": script_start_time,
+            "Command line": sys.argv,
+            "Stage": args.stage,
+            "Workers": args.workers,
+        }
+        atexit.register(metrics.write_json, args.metrics, run_info)
+
+    global shard
+    shard = args.shard
+    main_file = args.file
+    db_file = DB_FILE_NAME
+    cache_file = CACHE_FILE_NAME
+    archive_file = ARCHIVE_FILE_NAME
+    if shard:
+        # у каждого шарда свои файлы, шарды не мешают друг другу
+        main_file, db_file, cache_file, archive_file = (
+            shard_name(name, shard)
+            for name in [main_file, db_file, cache_file, archive_file]
+        )
+        working = main_file if args.storage == "xlsx" else db_file
+        print(f"Шард {shard[0]} из {shard[1]}, рабочий файл {working}")
+        source = args.file if args.storage == "xlsx" else DB_FILE_NAME
+        if not copy_to_shard(source, shard):
+            print(
+                f"Файл шарда {working} старше рабочего файла {source}: слейте его командой merge или удалите, тогда он будет создан копией рабочего файла"
+            )
+            return
+
+    if nothing_to_do(args, main_file):
         print(
-            f"Файл {MAIN_FILE_NAME} не найден, он будет создан при закрытии программы"
+            f"По файлу {main_file} для этапа {args.stage} работы нет, файл не загружается"
         )
-        wb = openpyxl.Workbook()
+        return
+
+    import_modules()
+    if args.parser:
+        parsing.set_backend(args.parser)
+
+    global base_url
+    if args.base_url != SITE_URL:
+        print(f"Вместо сайта {SITE_URL} используется {args.base_url}")
+    base_url = args.base_url
+
+    global blacklist
+    if args.blacklist:
+        print(f"Чёрный список загружается из файла {args.blacklist}")
+        blacklist = Blacklist(read_patterns(args.blacklist))
+
+    global parser_pool
+    parsers = args.parsers
+    if parsers is None:
+        if args.stage == "reparse":
+            # без сети работа - только разбор страниц
+            parsers = os.cpu_count() or 1
+        elif args.workers > 1:
+            parsers = min(os.cpu_count() or 1, args.workers)
+        else:
+            # при одном потоке скачивания разбирать параллельно нечего
+            parsers = 0
+    parser_pool = ParsePool(parsers)
+    atexit.register(parser_pool.close)
+
+    with metrics.timer("workbook", "load"):
+        if args.storage == "sqlite" or args.stage in ["export", "import"]:
+            print(f"Рабочее хранилище - база {db_file}")
+            wb = SQLiteStore(db_file)
+        elif os.path.exists(main_file):
+            print(f"Файл {main_file} найден, он будет дополнен")
+            wb = openpyxl.open(main_file)
+        else:
+            print(f"Файл {main_file} не найден, он будет создан при закрытии программы")
+            wb = openpyxl.Workbook()
+
+    journal = None
+    if not isinstance(wb, SQLiteStore):
+        # все изменения сразу пишутся в журнал, при аварии они не пропадут
+        journal = Journal(main_file + JOURNAL_SUFFIX)
+        atexit.register(journal.close)
+        with metrics.timer("workbook", "journal"):
+            replayed = attach_journal(wb, journal)
+        if replayed:
+            print(
+                f"Найден журнал незавершённого запуска, восстановлено изменений: {replayed}"
+            )
+        moved = migrate_wide_columns(wb)
+        if moved:
+            print(
+                f"Участники и товары {moved} лотов перенесены из колонок вкладки lots на вкладки suppliers и goods"
+            )
 
     log = get_wrapper(wb, "log", 0)
+    http_client.configure(
+        args.workers,
+        args.stage,
+        cache_file=None if args.no_cache else cache_file,
+        cache_only=args.cache_only,
+        max_rate=args.max_rps,
+        archive_file=None if args.no_archive else archive_file,
+    )
 
+    # файлы шардов, слитые командой merge, удаляются после сохранения
+    merged = []
     log_entry = {
         "Date time": script_start_time,
         "Script name": script_name,
@@ -67,9 +249,14 @@ def main():
         "Command line": json.dumps(sys.argv),
         "Stage": args.stage,
     }
+    if shard:
+        log_entry["Shard"] = f"{shard[0]}/{shard[1]}"
 
-    if args.stage == 1:
-        print("Этап 1, первичный сбор данных с сайта")
+    if args.stage in [1, "auto"]:
+        if args.stage == 1:
+            print("Этап 1, первичный сбор данных с сайта")
+        else:
+            print("Этапы 1 и 2: найденные лоты сразу обрабатываются на втором этапе")
         inn_list = args.inn
         years = []
         if not inn_list:
@@ -106,24 +293,82 @@ def main():
             log_entry["INN list"] = json.dumps(inn_list)
             log_entry["Years"] = json.dumps(years)
 
-        do_stage_one(wb, inn_list, years)
-
+        do_stage_one(
+            wb,
+            inn_list,
+            years,
+            args.workers,
+            enrich=args.stage == "auto",
+            retries=args.retries,
+        )
+        if args.stage == "auto":
+            # лоты прошлых запусков, не прошедшие второй этап
+            do_stage_two(wb, args.workers, args.retries)
+
+    elif args.stage == "refresh":
+        print("Обновление лотов, изменившихся после прошлого поиска")
+        if args.inn:
+            log_entry["INN list"] = json.dumps(args.inn)
+        do_refresh(wb, args.inn, args.workers)
     elif args.stage == 2:
         print("Этап 2, сбор дополнительных данных по каждому лоту")
-        do_stage_two(wb)
+        do_stage_two(wb, args.workers, args.retries)
     elif args.stage == 3:
         print("Этап 3, скачивание доп информации по отмеченным лотам")
-        do_stage_three(wb)
+        do_stage_three(wb, args.workers, args.retries)
+    elif args.stage == "reparse":
+        print(f"Повторный разбор страниц из архива {archive_file}")
+        do_reparse(wb, archive_file, args.workers)
+    elif args.stage == "merge":
+        target = db_file if isinstance(wb, SQLiteStore) else main_file
+        print(f"Слияние файлов шардов в {target}")
+        merged = do_merge(wb, find_shards(main_file) + find_shards(db_file))
+    elif args.stage == "wide":
+        print(
+            f"Выгрузка лотов с участниками и товарами в колонках в файл {WIDE_FILE_NAME}"
+        )
+        export_wide(wb, WIDE_FILE_NAME)
+    elif args.stage == "export":
+        print(f"Выгрузка данных из базы {db_file} в файл {main_file}")
+        export_workbook(wb, main_file)
+    elif args.stage == "import":
+        print(f"Загрузка изменений из файла {main_file} в базу {db_file}")
+        if os.path.exists(main_file):
+            import_workbook(wb, main_file)
+        else:
+            print(f"Файл {main_file} не найден")
 
+    http_client.report()
+    # в том числе фиксирует последнюю пачку страниц архива
+    http_client.close()
+    metrics.report()
+
+    log_entry.update(metrics.metrics.totals())
     log.append(log_entry)
 
+    if isinstance(wb, SQLiteStore):
+        with metrics.timer("workbook", "save"):
+            wb.close()
+        remove_shards(merged)
+        return
+
     try:
-        wb.save(MAIN_FILE_NAME)
+        with metrics.timer("workbook", "save"):
+            save_workbook(wb, main_file)
+        write_index(
+            main_file + INDEX_SUFFIX,
+            main_file,
+            get_wrapper(wb, "lots", 2),
+            get_wrapper(wb, "jobs", 1),
+        )
+        # изменения из журнала теперь сохранены в файле
+        journal.compact()
+        remove_shards(merged)
     except OSError:
-        alt_name = make_do_not_exists(MAIN_FILE_NAME)
-        print(f"Проблема с записью в файл {MAIN_FILE_NAME}")
+        alt_name = make_do_not_exists(main_file)
+        print(f"Проблема с записью в файл {main_file}")
         print(f"Попробуем файл {alt_name}")
-        wb.save(alt_name)
+        save_workbook(wb, alt_name)
 
 
 def command_line_processing():
@@ -135,16 +380,27 @@ def command_line_processing():
         metavar="STAGE",
         nargs="?",
         default=1,
-        type=int,
-        help="Этап работы, варианты: 1, 2 или 3",
-        choices=[1, 2, 3],
+        type=stage_type,
+        help="Этап работы, варианты: 1, 2 или 3; auto - этап 1, найденные лоты сразу проходят этап 2; refresh - найти лоты, изменившиеся после прошлого поиска; reparse - заново разобрать страницы из архива без обращения к сайту; merge - слить файлы шардов (--shard) в рабочий файл; export - выгрузить базу в Excel файл, wide - выгрузить лоты с участниками и товарами в колонках строки лота в файл zakupki_wide.xlsx, import - загрузить из Excel файла удалённые лоты и отметки stage3",
+        choices=[
+            1,
+            2,
+            3,
+            "auto",
+            "refresh",
+            "reparse",
+            "merge",
+            "wide",
+            "export",
+            "import",
+        ],
     )
     parser.add_argument(
         "-i",
         "--inn",
         metavar="INN",
         nargs="+",
-        help="ИНН (один или несколько) для сбора статистики; на этапе 1 должен быть указан. На этапах 2-3 параметр будет проигнорирован",
+        help="ИНН (один или несколько) для сбора статистики; на этапе 1 должен быть указан, для refresh - необязателен (по умолчанию обновляются все ИНН). На этапах 2-3 параметр будет проигнорирован",
         dest="inn",
         default=[],
     )
@@ -158,68 +414,158 @@ def command_line_processing():
         dest="year",
         default=[],
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        metavar="N",
+        type=int,
+        help="Количество одновременно выполняемых заданий: поисков на этапе 1, лотов на этапе 2, скачиваемых файлов на этапе 3 (по умолчанию 1)",
+        dest="workers",
+        default=1,
+    )
+    parser.add_argument(
+        "--parsers",
+        metavar="N",
+        type=int,
+        help="Количество процессов разбора скачанных страниц, 0 - разбирать в потоках скачивания (по умолчанию по числу ядер, но не больше -w)",
+        dest="parsers",
+    )
+    parser.add_argument(
+        "-b",
+        "--blacklist",
+        metavar="FILE",
+        help="Файл с чёрным списком названий лотов для этапа 1: по одному регулярному выражению в строке, строки с # - комментарии (по умолчанию - список из bad_list.py)",
+        dest="blacklist",
+    )
+    parser.add_argument(
+        "-p",
+        "--parser",
+        help="Парсер HTML страниц: lxml - быстрый, разбирает только нужные части страниц; html.parser - встроенный в Python, разбирает страницы целиком (по умолчанию lxml, если он установлен)",
+        dest="parser",
+        choices=PARSERS,
+    )
+    parser.add_argument(
+        "-s",
+        "--storage",
+        help=f"Рабочее хранилище: Excel файл {MAIN_FILE_NAME} (по умолчанию) или база SQLite {DB_FILE_NAME}",
+        dest="storage",
+        choices=["xlsx", "sqlite"],
+        default="xlsx",
+    )
+    parser.add_argument(
+        "--file",
+        metavar="FILE",
+        help=f"Рабочий Excel файл (по умолчанию {MAIN_FILE_NAME})",
+        dest="file",
+        default=MAIN_FILE_NAME,
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="K/N",
+        type=parse_shard,
+        help="Выполнить K-ю из N частей работы: задания этапа 1 делятся по ИНН и году, refresh - по ИНН, лоты этапов 2-3 - по реестровому номеру. Шард работает со своими файлами (zakupki.KofN.xlsx, кэш, архив), если его файла нет - копируется рабочий файл; команда merge сливает файлы шардов в рабочий файл",
+        dest="shard",
+    )
+    parser.add_argument(
+        "--base-url",
+        metavar="URL",
+        help=f"Адрес сайта, например http://127.0.0.1:8000 для сервера bench/mock_server.py (по умолчанию {SITE_URL})",
+        dest="base_url",
+        type=lambda url: url.rstrip("/"),
+        default=SITE_URL,
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Записать замеры времени запросов к сайту, разбора страниц и работы с файлом в JSON файл",
+        dest="metrics",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Записать профиль cProfile всей работы программы (всех потоков) в файл pstats",
+        dest="profile",
+    )
+    parser.add_argument(
+        "--retries",
+        metavar="N",
+        type=int,
+        help=f"Сколько раз повторять в том же запуске задание с временной ошибкой сайта: таймаут, обрыв соединения, ответ 5xx ({RETRIES})",
+        dest="retries",
+        default=RETRIES,
+    )
+    parser.add_argument(
+        "--max-rps",
+        metavar="N",
+        type=float,
+        help="Не больше N запросов к сайту в секунду (по умолчанию скорость снижается, только если сайт отвечает 429 или ошибками)",
+        dest="max_rps",
+    )
+    parser.add_argument(
+        "--no-archive",
+        help=f"Не сохранять скачанные страницы в архив {ARCHIVE_FILE_NAME}",
+        dest="no_archive",
+        action="store_true",
+    )
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--no-cache",
+        help=f"Не использовать кэш страниц сайта {CACHE_FILE_NAME}",
+        dest="no_cache",
+        action="store_true",
+    )
+    cache_group.add_argument(
+        "--cache-only",
+        help="Брать страницы только из кэша, не обращаясь к сайту",
+        dest="cache_only",
+        action="store_true",
+    )
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("количество потоков должно быть не меньше 1")
+    if args.parsers is not None and args.parsers < 0:
+        parser.error("количество процессов разбора не может быть отрицательным")
+    if args.retries < 0:
+        parser.error("количество повторов не может быть отрицательным")
+    if args.max_rps is not None and args.max_rps <= 0:
+        parser.error("скорость запросов должна быть больше 0")
+    if args.shard and args.stage in ["merge", "export", "import", "wide"]:
+        parser.error(f"команда {args.stage} работает со всеми данными, без --shard")
     return args
 
 
-class WSWrapper:
-    def __init__(self, ws):
-        self.ws = ws
+def stage_type(value):
+    return int(value) if value.isdigit() else value
 
-        if ws.max_column <= 1 and ws.max_row <= 1:
-            ws["A1"] = "ID"
-            self.name_to_index = {"ID": 1}
-            self.names = ["ID"]
-            self.new_ID = 1
-        else:
-            self.name_to_index = {}
-            self.names = [None] * ws.max_column
-            for i in range(ws.max_column):
-                name = ws.cell(1, i + 1).value
-                self.name_to_index[name] = i + 1
-                self.names[i] = name
-            self.new_ID = 1
-            for j in range(ws.max_row - 1):
-                self.new_ID = max(self.new_ID, 1 + int(ws.cell(2 + j, 1).value))
-
-    def __len__(self):
-        return self.ws.max_row - 1
-
-    def __getitem__(self, index):
-        if index < 0 or index > self.ws.max_row - 2:
-            raise KeyError
-        tmp = {}
-        for i in range(self.ws.max_column):
-            name = self.ws.cell(1, i + 1).value
-            tmp[name] = self.ws.cell(index + 2, i + 1).value
-        return tmp
-
-    def __setitem__(self, index, record):
-        if index > self.ws.max_row - 2:
-            raise KeyError
-        for name in record:
-            if name in self.name_to_index:
-                col = self.name_to_index[name]
-            else:
-                col = self.ws.max_column + 1
-                self.name_to_index[name] = col
-                self.ws.cell(1, col).value = name
-            self.ws.cell(index + 2, col).value = record[name]
 
-    def append(self, record):
-        index = self.ws.max_row - 1
-        self.ws.cell(index + 2, 1).value = self.new_ID
-        self.new_ID += 1
-        self[index] = record
+def copy_to_shard(file_name, shard):
+    """Start the file of the shard from the working file if it has none
 
+    Output: False if the file of the shard is older than the working file"""
 
-def get_wrapper(wb, sheet_name, position):
-    if sheet_name in wb:
-        sheet = wb[sheet_name]
-    else:
-        sheet = wb.create_sheet(sheet_name, position)
-    wrapper = WSWrapper(sheet)
-    return wrapper
+    target = shard_name(file_name, shard)
+    if not os.path.exists(file_name):
+        return True
+    if not os.path.exists(target):
+        print(f"Файл шарда {target} не найден, он создаётся копией {file_name}")
+        shutil.copyfile(file_name, target)
+        return True
+    # рабочий файл изменён (например, слиянием) после начала работы шарда:
+    # шард работал бы со старыми лотами и заданиями
+    return os.path.getmtime(target) >= os.path.getmtime(file_name)
+
+
+def remove_shards(file_names):
+    """Delete merged files of shards with their indexes"""
+
+    for file_name in file_names:
+        for name in [file_name, file_name + INDEX_SUFFIX]:
+            if os.path.exists(name):
+                os.remove(name)
+    if file_names:
+        print(
+            f"Слитые файлы шардов удалены: {', '.join(file_names)}; следующий запуск с --shard начнёт их заново с копии рабочего файла"
+        )
 
 
 def make_do_not_exists(file_name):
@@ -229,70 +575,390 @@ def make_do_not_exists(file_name):
     Output: file name (the same or modified) do not exist"""
 
     while os.path.exists(file_name):
-        path, name = os.path.split(file_name)
-        name, ext = os.path.splitext(name)
-        match = re.match(r"(.*)\(([0-9]+)\)", name)
-        try:
-            name = f"{match[1].strip()} ({int(match[2])+1}){ext}"
-        except Exception:
-            name = f"{name.strip()} (1){ext}"
-        file_name = os.path.join(path, name)
+        file_name = next_file_name(file_name)
     return file_name
 
 
-def do_stage_one(wb, inn_list, years):
-    jobs = get_wrapper(wb, "jobs", 1)
+def next_file_name(file_name):
+    """Make next name for file: `name.ext` -> `name (1).ext` -> `name (2).ext`"""
+
+    path, name = os.path.split(file_name)
+    name, ext = os.path.splitext(name)
+    match = re.match(r"(.*)\(([0-9]+)\)", name)
+    try:
+        name = f"{match[1].strip()} ({int(match[2])+1}){ext}"
+    except Exception:
+        name = f"{name.strip()} (1){ext}"
+    return os.path.join(path, name)
+
+
+def do_stage_one(wb, inn_list, years, workers=1, enrich=False, retries=RETRIES):
+    """Find lots of INNs for the years and put them on the `lots` sheet
+
+    With `enrich` found lots are collected for stage 2 in the same pool
+    while the search goes on. Windows, their pages and lots with transient
+    errors are retried up to `retries` times each"""
+
+    jobs = KeyedTable(get_wrapper(wb, "jobs", 1), ["INN", "year", "month"], job_key)
     current_year = script_start_time.year
     current_month = script_start_time.month
 
-    job = {"state": "pending"}
     for inn in inn_list:
-        job["INN"] = inn
         for year in years:
-            job["year"] = year
+            if not in_shard(*job_key((inn, year, 1))[:2]):
+                continue
             for month in range(1, 13):
                 if year == current_year and month > current_month:
                     break
-                job["month"] = month
-                jobs.append(job)
+                job = {"state": "pending", "INN": inn, "year": year, "month": month}
+                i = jobs.find(job)
+                if i is None:
+                    jobs.append(job)
+                elif (year, month) == (current_year, current_month):
+                    # текущий месяц ещё не закончился, его лоты ищем заново
+                    if jobs.table[i]["state"] == "done":
+                        jobs.table[i] = {"state": "pending"}
+
+    lots = KeyedTable(get_wrapper(wb, "lots", 2), ["number"], lot_key)
+    marks = KeyedTable(get_wrapper(wb, "refresh", 3), ["INN"], inn_key)
+    jobs = jobs.table
+
+    # месяц -> невыполненные строки листа jobs; в файлах прошлых версий
+    # программы у одного месяца бывает несколько строк
+    rows = {}
+    # месяц -> количество лотов, найденных в нём прошлыми поисками
+    known = {}
+    for i, values in enumerate(
+        zip(
+            jobs.column("state"),
+            jobs.column("INN"),
+            jobs.column("year"),
+            jobs.column("month"),
+            jobs.column("found"),
+        )
+    ):
+        state, *key, found = values
+        key = job_key(key)
+        if found is not None:
+            known[key] = max(known.get(key, 0), int(found))
+        if state != "done" and in_shard(*key[:2]):
+            rows.setdefault(key, []).append(i)
+    if not rows:
+        return
+    windows = plan_windows(list(rows), known)
+    print(
+        f"Заданий к выполнению: {len(rows)}, окон поиска: {len(windows)}, потоков: {workers}"
+    )
 
-    lots = get_wrapper(wb, "lots", 2)
+    counts = {"new": 0, "updated": 0, "same": 0}
+    # месяц -> количество ещё не просмотренных окон, в которые он входит
+    left = dict.fromkeys(rows, 0)
+    failed = set()
+    # месяц -> количество лотов, найденных в нём в этом запуске
+    found_in = dict.fromkeys(rows, 0)
+    # окно -> количество страниц, которые ещё скачиваются
+    unfinished = {}
+    # окна, ещё не отданные потокам
+    waiting = deque()
+    # лоты, отправленные на этап 2 в этом запуске
+    enriched = set()
+    details = LotDetails(wb) if enrich else None
+    retry_queue = RetryQueue("auto" if enrich else 1, retries)
+    # Окна и страницы просматриваются параллельно, но в листы jobs и lots
+    # пишет только основной поток - openpyxl не рассчитан на работу из потоков
+    with ThreadPoolExecutor(max_workers=workers) as executor, ThreadPoolExecutor(
+        max_workers=2 * workers
+    ) as page_pool:
+        futures = {}
+        searching = 0
+
+        def plan(window):
+            for key in window_months(window):
+                left[key] += 1
+            waiting.append(window)
+
+        def submit_windows():
+            # В работе не больше окон, чем потоков: лоты для этапа 2
+            # встают в очередь пула между окнами, а не после всего поиска
+            nonlocal searching
+            while waiting and searching < workers:
+                window = waiting.popleft()
+                futures[executor.submit(search_window, window)] = ("window", window)
+                searching += 1
+
+        def submit_page(window, page_number):
+            future = page_pool.submit(search_page, window, page_number)
+            futures[future] = ("page", (window, page_number))
+
+        def store_lots(window, found):
+            for record in found:
+                counts[lots.upsert(record, LOT_UPDATE_FIELDS)] += 1
+                if enrich:
+                    submit_lot(lots.find(record))
+                published = as_date(record["published"])
+                if published is not None:
+                    key = (window[0], published.year, published.month)
+                    if key in found_in:
+                        found_in[key] += 1
+            remember_updated(marks, window[0], found)
+
+        def submit_lot(i):
+            record = lots.table[i]
+            if i in enriched or record["stage2"] not in ["none", "error"]:
+                return
+            enriched.add(i)
+            status = check_stage_two(i, record)
+            if status:
+                lots.table[i] = {"stage2": status}
+                return
+            futures[executor.submit(enrich_lot, record, page_pool)] = ("lot", i)
+
+        def finish_window(window):
+            nonlocal searching
+            searching -= 1
+            unfinished.pop(window, None)
+            for key in window_months(window):
+                left[key] -= 1
+                if left[key] > 0:
+                    continue
+                if key in failed:
+                    update = {"state": "error"}
+                else:
+                    update = {"state": "done", "found": found_in[key]}
+                for i in rows[key]:
+                    jobs[i] = update
+            submit_windows()
+
+        def page_done(window):
+            unfinished[window] -= 1
+            if unfinished[window] == 0:
+                finish_window(window)
+
+        for window in windows:
+            plan(window)
+        submit_windows()
+
+        while futures or retry_queue:
+            done = wait_done(futures, retry_queue)
+
+            for future in done:
+                kind, item = futures.pop(future)
+                if kind == "lot":
+                    record = lots.table[item]
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        if retry_queue.failed(lot_text(record), (kind, item), e):
+                            continue
+                        # собранные прошлыми запусками участники и товары остаются
+                        record["stage2"] = "error"
+                        lots.table[item] = {"stage2": "error"}
+                    else:
+                        details.write(lots.table, item, record)
+                    print(
+                        f'Аукцион #{item+1:3d}, название `{record["name"]}`: {record["stage2"]}'
+                    )
+                elif kind == "page":
+                    window, page_number = item
+                    try:
+                        found = future.result()
+                    except Exception as e:
+                        text = f"{window_text(window)}, страница {page_number}"
+                        if retry_queue.failed(text, (kind, item), e):
+                            continue
+                        # лоты остальных страниц сохранены, месяцы окна
+                        # будут найдены заново при следующем запуске
+                        failed.update(window_months(window))
+                    else:
+                        store_lots(window, found)
+                    page_done(window)
+                else:
+                    window = item
+                    try:
+                        pages, found = future.result()
+                    except TooManyEntries:
+                        # окно делится пополам, месяцы ждут обе половины
+                        searching -= 1
+                        for half in split_window(window):
+                            plan(half)
+                        for key in window_months(window):
+                            left[key] -= 1
+                        submit_windows()
+                        continue
+                    except Exception as e:
+                        if retry_queue.failed(window_text(window), (kind, item), e):
+                            # месяцы окна ждут его повтора, место в работе - за ним
+                            continue
+                        failed.update(window_months(window))
+                        finish_window(window)
+                        continue
+                    store_lots(window, found)
+                    unfinished[window] = pages - 1
+                    if pages == 1:
+                        finish_window(window)
+                        continue
+                    # остальные страницы окна скачиваются одновременно,
+                    # и каждая при ошибке повторяется отдельно
+                    for page_number in range(2, pages + 1):
+                        submit_page(window, page_number)
+
+            for kind, item in retry_queue.due():
+                if kind == "window":
+                    future = executor.submit(search_window, item)
+                elif kind == "page":
+                    future = page_pool.submit(search_page, *item)
+                else:
+                    future = executor.submit(enrich_lot, lots.table[item], page_pool)
+                futures[future] = (kind, item)
+
+    print(
+        f'Лотов новых: {counts["new"]}, обновлено: {counts["updated"]}, без изменений: {counts["same"]}'
+    )
+    if enrich:
+        print(f"Лотов отправлено на этап 2 во время поиска: {len(enriched)}")
+    blacklist.report()
+    save_failures(wb, retry_queue)
 
-    jobs_count = len(jobs)
-    for i in range(jobs_count):
-        job = jobs[i]
 
-        if job["state"] == "done":
-            continue
+def job_key(values):
+    """Normalized key (INN, year, month) of the job"""
 
-        try:
-            complete_the_task(lots, job)
-        except Exception as e:
-            print(
-                f"Какая-то ошибка с заданием {job}, запустите программу ещё раз без аргументов для выполнения всех отложенных задач"
-            )
-            print("Вот описание ошибки:")
-            print(e)
-            job["state"] = "error"
-        else:
-            job["state"] = "done"
-        jobs[i] = job
+    inn, year, month = values
+    try:
+        return str(inn).strip(), int(year), int(month)
+    except (TypeError, ValueError):
+        return values
+
+
+def lot_key(values):
+    """Normalized key of the lot - registry number without quotes"""
 
+    (number,) = values
+    return str(number).strip('"') if number else None
 
-def complete_the_task(lots, job):
-    target_inn = str(job["INN"])
-    target_year = int(job["year"])
-    target_month = int(job["month"])
 
+def in_shard(*key):
+    """True if the item with the key is the work of this run"""
+
+    return shard is None or shard_of(":".join(map(str, key)), shard[1]) == shard[0]
+
+
+def lot_text(record):
+    number = str(record["number"]).strip('"')
+    return f"аукцион {number}"
+
+
+def wait_done(futures, retry_queue, timeout=None):
+    """Wait for finished futures, or for the next retry if none is running
+
+    Output: set of finished futures"""
+
+    timeout = retry_queue.timeout(timeout)
+    if not futures:
+        time.sleep(timeout)
+        return set()
+    done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+    return done
+
+
+def save_failures(wb, retry_queue):
+    """Append items failed in the stage to the `errors` sheet"""
+
+    retry_queue.report()
+    if not retry_queue.dead:
+        return
+    errors = get_wrapper(wb, "errors", 6)
+    for entry in retry_queue.dead:
+        errors.append({"Date time": script_start_time, **entry})
     print(
-        f"Ищем аукционы для ИНН {target_inn} за год {target_year}, месяц {target_month}"
+        "Невыполненные задания перечислены на вкладке errors, они будут выполнены при следующем запуске"
     )
 
-    extended_search = "https://zakupki.gov.ru/epz/order/extendedsearch/results.html"
-    params = {
+
+class TooManyEntries(Exception):
+    """The site found more lots in the window than it can show"""
+
+
+def plan_windows(keys, known=None):
+    """Group months of pending jobs into search windows
+
+    Input: `keys` - list of job keys (INN, year, month), `known` - dict
+        job key -> number of lots found in the month by earlier searches
+    Output: list of windows (INN, first date, last date). Consecutive
+        months of the same INN and year are merged while the lots expected
+        in the window fit one page of results, so a busy month is searched
+        alone. A month without history is expected to have the average
+        number of lots of the INN, or none for a new INN: then the window
+        is split later if the site finds too many lots in it"""
+
+    known = known or {}
+    history = {}
+    for (inn, _, _), count in known.items():
+        history.setdefault(inn, []).append(count)
+
+    windows = []
+    expected = 0
+    for key in sorted(set(keys)):
+        inn, year, month = key
+        if key in known:
+            count = known[key]
+        elif inn in history:
+            count = sum(history[inn]) / len(history[inn])
+        else:
+            count = 0
+        date1 = date(year, month, 1)
+        date2 = date1.replace(day=calendar.monthrange(year, month)[1])
+        if windows:
+            last_inn, last_date1, last_date2 = windows[-1]
+            if (
+                last_inn == inn
+                and last_date2.year == year
+                and last_date2 + timedelta(days=1) == date1
+                and expected + count <= RECORDS_PER_PAGE
+            ):
+                windows[-1] = (inn, last_date1, date2)
+                expected += count
+                continue
+        windows.append((inn, date1, date2))
+        expected = count
+    return windows
+
+
+def window_months(window):
+    """Job keys (INN, year, month) of all months of the window"""
+
+    inn, date1, date2 = window
+    year, month = date1.year, date1.month
+    while (year, month) <= (date2.year, date2.month):
+        yield inn, year, month
+        year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+
+
+def split_window(window):
+    """Split the window in two halves: by months, or by days inside a month"""
+
+    inn, date1, date2 = window
+    months = list(window_months(window))
+    if len(months) > 1:
+        _, year, month = months[len(months) // 2]
+        middle = date(year, month, 1) - timedelta(days=1)
+    else:
+        middle = date1 + (date2 - date1) // 2
+    return [(inn, date1, middle), (inn, middle + timedelta(days=1), date2)]
+
+
+def window_text(window):
+    inn, date1, date2 = window
+    return f'ИНН {inn} от {date1.strftime("%d.%m.%Y")} до {date2.strftime("%d.%m.%Y")}'
+
+
+def search_params(inn):
+    """Query parameters of the extended search of lots of the INN"""
+
+    return {
         "morphology": "on",
         "sortDirection": "false",
-        "recordsPerPage": "_50",
+        "recordsPerPage": f"_{RECORDS_PER_PAGE}",
         "showLotsInfoHidden": "false",
         "sortBy": "UPDATE_DATE",
         "fz44": "on",
@@ -314,57 +980,502 @@ def complete_the_task(lots, job):
         "contractPriceCurrencyId": "-1",
         "budgetLevelIdNameHidden": "%7B%7D",
         "nonBudgetTypesIdNameHidden": "%7B%7D",
-        "searchString": target_inn,
+        "searchString": inn,
     }
 
-    date1 = date(target_year, target_month, 1)
-    _, m = calendar.monthrange(target_year, target_month)
-    date2 = date1.replace(day=m)
 
+def fetch_search_page(params, page_number):
+    """Page of search results
+
+    Output: (text of the total or None, number of entries on the page,
+        list of lot records)"""
+
+    extended_search = base_url + "/epz/order/extendedsearch/results.html"
+    response = http_client.get(
+        extended_search,
+        params={**params, "pageNumber": str(page_number)},
+    )
+    if response.status_code != 200:
+        raise SiteError(response)
+
+    return parser_pool.parse(parse_search_page, response.content, response.encoding)
+
+
+def parse_search_page(content, encoding, site=None):
+    """Parse page of search results, see `fetch_search_page`
+
+    Input: `content` - bytes of the page, `encoding` - its encoding,
+        `site` - address of the site the page is fetched from for links
+        of lots (None - `base_url`)"""
+
+    with metrics.timer("parse", "search page"):
+        soup = make_soup(decode(content, encoding), "search")
+        part = soup.find("div", "search-results__total")
+    lots = []
+    count = work_with_searchresult(lots, soup, site)
+    return part.text.strip() if part else None, count, lots
+
+
+def window_params(window):
+    """Query parameters of the search of lots published in the window"""
+
+    inn, date1, date2 = window
+    params = search_params(inn)
     params["publishDateFrom"] = date1.strftime("%d.%m.%Y")
     params["publishDateTo"] = date2.strftime("%d.%m.%Y")
+    return params
 
-    print(f'Период от {params["publishDateFrom"]} до {params["publishDateTo"]}')
 
-    page_number = 1
-    while True:
-        params["pageNumber"] = str(page_number)
-        response = requests.get(
-            extended_search,
-            headers=headers,
-            params=params,
-            timeout=60,
-        )
-        if response.status_code != 200:
-            print("Ошибка связи с сайтом. Запустите программу ещё раз")
-            raise Exception(
-                f"Request url {response.request.url} result {response.status_code}"
-            )
+def search_window(window):
+    """Find lots of the first page of the window in a worker thread
+
+    Input: `window` - (INN, first date, last date)
+    Output: (number of pages of the window, list of lot records of the
+        first page), raises TooManyEntries if the window should be split"""
+
+    print(f"Ищем аукционы для {window_text(window)}")
+    value, count, found = fetch_search_page(window_params(window), 1)
+    value = value or "0"
+    print(f"Найдено аукционов за период {window_text(window)}: `{value}`")
+    if value.startswith("бол"):
+        if window[1] < window[2]:
+            raise TooManyEntries(value)
+        print("Найдено слишком много записей за один день, их невозможно получить")
+        raise Exception("Too many entries")
+    if count == 0:
+        return 1, found
+    # количество страниц известно, лишняя пустая страница не нужна
+    total = int(re.sub(r"\D", "", value) or 0)
+    return max(1, -(-total // RECORDS_PER_PAGE)), found
 
-        soup = BeautifulSoup(response.text, "html.parser")
 
+def search_page(window, page_number):
+    """Lot records of the page of the window after the first one"""
+
+    _, _, found = fetch_search_page(window_params(window), page_number)
+    return found
+
+
+def refresh_inn(inn, mark, window=None):
+    """Find lots of the INN updated since the date `mark` in a worker thread
+
+    Results are sorted by update date, newest first, so pages are read
+    until the first lot updated before `mark`. The site shows not more
+    than a limited number of records: if all of them are newer than
+    `mark`, the rest of the lots are not read
+
+    Input: `window` - (INN, first date, last date) of publishing or None
+    Output: (list of lot records, False if the lots are not complete)"""
+
+    if window is None:
+        params = search_params(inn)
+        text = f"ИНН {inn}"
+    else:
+        params = window_params(window)
+        text = window_text(window)
+    print(f"Ищем аукционы {text}, обновлённые с {mark.strftime('%d.%m.%Y')}")
+
+    lots = []
+    page_number = 1
+    pages = 1
+    capped = False
+    while page_number <= pages:
+        value, count, found = fetch_search_page(params, page_number)
         if page_number == 1:
-            part = soup.find("div", "search-results__total")
-            value = part.text.strip()
-            print(f"Найдено всего аукционов за период: `{value}`")
-            if value.startswith("бол"):
-                print(
-                    "Найдено слишком много записей, попробуйте разбить диапазон времени сильнее"
-                )
-                raise Exception("Too many entries")
-        count = work_with_searchresult(lots, soup)
+            value = value or "0"
+            print(f"Найдено всего аукционов {text}: `{value}`")
+            # при `более N` сайт показывает только N записей
+            capped = value.startswith("бол")
+            total = int(re.sub(r"\D", "", value) or 0)
+            pages = -(-total // RECORDS_PER_PAGE)
+
+        lots.extend(found)
         if count == 0:
             break
+        if any(lot_date(record) < mark for record in found):
+            # дальше идут лоты, не менявшиеся с прошлого обновления
+            return lots, True
         page_number += 1
+    return lots, not capped
+
+
+def lot_date(record):
+    """Date of the last change of the lot found by search"""
+
+    return as_date(record.get("updated") or record.get("published") or date.min)
+
+
+def as_date(value):
+    # openpyxl читает даты из файла как datetime
+    return value.date() if isinstance(value, datetime) else value
+
+
+def inn_key(values):
+    """Normalized key of the record of the `refresh` sheet"""
+
+    (inn,) = values
+    return str(inn).strip() if inn is not None else None
 
 
-def work_with_searchresult(lots, soup):
+def remember_updated(marks, inn, lots):
+    """Keep in `marks` (`refresh` sheet) the newest update date of INN lots"""
+
+    if not lots:
+        return
+    newest = max(lot_date(record) for record in lots)
+    i = marks.find({"INN": inn})
+    if i is None:
+        marks.append({"INN": inn, "updated": newest})
+    elif newest > as_date(marks.table[i]["updated"] or date.min):
+        marks.table[i] = {"updated": newest}
+
+
+def do_refresh(wb, inn_list, workers=1):
+    marks = KeyedTable(get_wrapper(wb, "refresh", 3), ["INN"], inn_key)
+    if not inn_list:
+        inn_list = [inn for inn in marks.table.column("INN") if inn is not None]
+
+    tasks = []
+    for inn in inn_list:
+        i = marks.find({"INN": inn})
+        if i is None:
+            print(f"Для ИНН {inn} ещё не выполнялся этап 1, обновлять нечего")
+            continue
+        if in_shard(inn_key((inn,))):
+            tasks.append((str(inn).strip(), as_date(marks.table[i]["updated"])))
+    if not tasks:
+        return
+    print(f"ИНН к обновлению: {len(tasks)}, потоков: {workers}")
+
+    lots = KeyedTable(get_wrapper(wb, "lots", 2), ["number"], lot_key)
+    counts = {"new": 0, "updated": 0, "same": 0}
+    requeued = 0
+    # ИНН -> количество незавершённых поисков, найденные лоты, была ли ошибка
+    states = {inn: {"left": 1, "found": [], "failed": False} for inn, _ in tasks}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for inn, mark in tasks:
+            futures[executor.submit(refresh_inn, inn, mark)] = (inn, mark, None)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                inn, mark, window = futures.pop(future)
+                state = states[inn]
+                state["left"] -= 1
+                try:
+                    found, complete = future.result()
+                except Exception as e:
+                    print(
+                        f"Какая-то ошибка с обновлением ИНН {inn}, запустите обновление ещё раз"
+                    )
+                    print("Вот описание ошибки:")
+                    print(e)
+                    state["failed"] = True
+                    found, complete = [], True
+
+                if not complete:
+                    # лоты за пределами показанных сайтом ищутся по периодам публикации
+                    window = window or (inn, SEARCH_FIRST_DATE, date.today())
+                    if window[1] < window[2]:
+                        for half in split_window(window):
+                            future = executor.submit(refresh_inn, inn, mark, half)
+                            futures[future] = (inn, mark, half)
+                            state["left"] += 1
+                    else:
+                        print(
+                            f"Слишком много записей для {window_text(window)}, их невозможно получить"
+                        )
+                        state["failed"] = True
+
+                for record in found:
+                    i = lots.find(record)
+                    old = None if i is None else lots.table[i]
+                    result = lots.upsert(record, LOT_UPDATE_FIELDS)
+                    counts[result] += 1
+                    if (
+                        result == "updated"
+                        and old["stage2"] == "done"
+                        and not same_value(old["updated"], record["updated"])
+                    ):
+                        # лот изменился на сайте, его данные надо собрать заново
+                        lots.table[i] = {"stage2": "none"}
+                        requeued += 1
+                state["found"].extend(found)
+                if state["left"] == 0:
+                    if state["failed"]:
+                        # дата не сдвигается, пропущенные лоты найдёт следующее обновление
+                        print(f"Дата обновления ИНН {inn} не изменена из-за ошибок")
+                    else:
+                        remember_updated(marks, inn, state["found"])
+
+    print(
+        f'Лотов новых: {counts["new"]}, обновлено: {counts["updated"]}, без изменений: {counts["same"]}'
+    )
+    print(f"Лотов снова отправлено на этап 2: {requeued}")
+    blacklist.report()
+
+
+def do_reparse(wb, archive_file, workers=1):
+    """Rebuild lots from pages of the archive without requests
+
+    Search pages are parsed in the order they were fetched, so newer
+    pages update lots after older ones; lots get stage 2 information
+    from the last fetched pages of the lot. New lots are added only to
+    the empty `lots` sheet: lots deleted by the user are not restored"""
+
+    if not os.path.exists(archive_file):
+        print(f"Архив {archive_file} не найден")
+        return
+    archive = PageArchive(archive_file)
+    lots = KeyedTable(get_wrapper(wb, "lots", 2), ["number"], lot_key)
+    details = LotDetails(wb)
+    # все страницы разбираются параллельно процессами parser_pool
+    threads = max(workers, parser_pool.processes, 1)
+    print(f"Потоков разбора: {threads}")
+
+    def parse_search(row):
+        # ссылки лотов ведут на сайт, с которого была скачана страница
+        _, url, encoding, body = row
+        parts = urlsplit(url)
+        site = f"{parts.scheme}://{parts.netloc}"
+        return parser_pool.parse(parse_search_page, unpack(body), encoding, site)
+
+    rebuild = len(lots.table) == 0
+    counts = {"new": 0, "updated": 0, "same": 0, "skipped": 0}
+    pages = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _, _, found in map_bounded(
+            executor, parse_search, archive.pages("search"), 2 * threads
+        ):
+            pages += 1
+            for record in found:
+                if not rebuild and lots.find(record) is None:
+                    counts["skipped"] += 1
+                    continue
+                # статусы этапов не меняются, остальные поля - как на странице
+                fields = [f for f in record if f not in ["stage2", "stage3"]]
+                counts[lots.upsert(record, fields)] += 1
+    print(
+        f'Страниц поиска: {pages}. Лотов новых: {counts["new"]}, обновлено: {counts["updated"]}, без изменений: {counts["same"]}, нет на листе lots: {counts["skipped"]}'
+    )
+    blacklist.report()
+
+    lot_pages = (
+        (number, {kind: (encoding, body) for _, kind, encoding, body in rows})
+        for number, rows in itertools.groupby(
+            archive.latest(["suppliers", "common"]), key=lambda row: row[0]
+        )
+    )
+
+    def parse_lot(item):
+        number, pages = item
+        if len(pages) < 2:
+            return number, None
+        info = {}
+        try:
+            for kind, parse in [
+                ("suppliers", parse_supplier_results),
+                ("common", parse_common_info),
+            ]:
+                encoding, body = pages[kind]
+                info.update(
+                    parser_pool.parse(parse_lot_page, parse, unpack(body), encoding)
+                )
+        except Exception as e:
+            return number, e
+        return number, info
+
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for number, info in map_bounded(executor, parse_lot, lot_pages, 2 * threads):
+            i = lots.find({"number": number})
+            if i is None or info is None:
+                continue
+            if isinstance(info, Exception):
+                print(f"Не удалось разобрать страницы аукциона {number}: {info}")
+                failed += 1
+                continue
+            record, _ = split_record("lots", lots.table[i])
+            record.update(info)
+            record["stage2"] = "done"
+            details.write(lots.table, i, record)
+            done += 1
+    print(f"Лотов с данными этапа 2: {done}, не разобрано: {failed}")
+
+    # Страниц отменённых лотов и лотов не по 44-ФЗ в архиве нет: этап 2
+    # не скачивает их, а определяет статус по полям лота
+    skipped = 0
+    for i, (stage2, stage, fz) in enumerate(
+        zip(
+            lots.table.column("stage2"),
+            lots.table.column("stage"),
+            lots.table.column("fz"),
+        )
+    ):
+        if stage2 != "none":
+            continue
+        status = stage_two_status({"stage": stage, "fz": fz})
+        if status:
+            lots.table[i] = {"stage2": status}
+            skipped += 1
+    print(f"Лотов, которым не нужен этап 2 (отменены или не по 44-ФЗ): {skipped}")
+    archive.close()
+
+
+def map_bounded(executor, func, items, limit):
+    """Like `executor.map`, but no more than `limit` items are submitted
+    at once, so a long iterator is not read into memory"""
+
+    futures = deque()
+    for item in items:
+        futures.append(executor.submit(func, item))
+        if len(futures) >= limit:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def do_merge(wb, file_names):
+    """Merge files of shards into the working file
+
+    Files are merged in order of shard numbers, so the result is the
+    same on every run: jobs keep the most complete state, lots are
+    unique by registry number and the lot with more complete stage 2
+    (then with later update) wins, `stage3` keeps the most complete mark.
+    Rows of `log` and `errors` are appended once
+
+    Input: `file_names` - files of shards, Excel or SQLite (`.db`)
+    Output: list of merged files"""
+
+    if not file_names:
+        print("Файлы шардов не найдены")
+        return []
+    jobs = KeyedTable(get_wrapper(wb, "jobs", 1), ["INN", "year", "month"], job_key)
+    lots = KeyedTable(get_wrapper(wb, "lots", 2), ["number"], lot_key)
+    marks = KeyedTable(get_wrapper(wb, "refresh", 3), ["INN"], inn_key)
+    details = LotDetails(wb)
+    # вкладки log и errors создаются, только если в шардах есть их строки
+    appended = {}
+    merged = []
+
+    def append_rows(name, position, fields, rows):
+        if not rows:
+            return 0
+        if name not in appended:
+            table = get_wrapper(wb, name, position)
+            appended[name] = KeyedTable(table, fields, str)
+        table = appended[name]
+        count = 0
+        for row in rows:
+            row.pop("ID", None)
+            if table.find(row) is None:
+                table.append(row)
+                count += 1
+        return count
+
+    for file_name in file_names:
+        if os.path.exists(file_name + JOURNAL_SUFFIX):
+            print(
+                f"У файла {file_name} есть журнал незавершённого запуска, файл пропущен: запустите шард ещё раз"
+            )
+            continue
+        if file_name.endswith(".db"):
+            source = SQLiteStore(file_name)
+        else:
+            source = openpyxl.open(file_name)
+        counts = {"jobs": 0, "new": 0, "updated": 0, "log": 0, "errors": 0}
+
+        for job in source_rows(source, "jobs"):
+            job.pop("ID", None)
+            i = jobs.find(job)
+            if i is None:
+                jobs.append(job)
+                counts["jobs"] += 1
+            elif JOB_RANK.get(job["state"], 0) > JOB_RANK.get(
+                jobs.table[i]["state"], 0
+            ):
+                jobs.table[i] = {"state": job["state"], "found": job.get("found")}
+                counts["jobs"] += 1
+
+        source_details = lot_details(source)
+        for record in source_rows(source, "lots"):
+            if lot_key((record["number"],)) is None:
+                continue
+            record.update(source_details.get(record.pop("ID"), {}))
+            i = lots.find(record)
+            if i is None:
+                fields, _ = split_record("lots", record)
+                lots.append(fields)
+                i = lots.find(record)
+                details.write(lots.table, i, {**record, "ID": lots.table[i]["ID"]})
+                counts["new"] += 1
+                continue
+            current = lots.table[i]
+            stage3 = max(
+                [current["stage3"], record["stage3"]],
+                key=lambda value: STAGE3_RANK.get(value, 0),
+            )
+            if lot_rank(record) > lot_rank(current):
+                record.update({"ID": current["ID"], "stage3": stage3})
+                details.write(lots.table, i, record)
+                counts["updated"] += 1
+            elif stage3 != current["stage3"]:
+                lots.table[i] = {"stage3": stage3}
+                counts["updated"] += 1
+
+        for mark in source_rows(source, "refresh"):
+            if mark["INN"] is not None and mark["updated"] is not None:
+                remember_updated(marks, mark["INN"], [mark])
+
+        counts["log"] = append_rows(
+            "log", 0, ["Date time", "Command line"], source_rows(source, "log")
+        )
+        counts["errors"] = append_rows(
+            "errors", 6, ["Date time", "stage", "item"], source_rows(source, "errors")
+        )
+        if isinstance(source, SQLiteStore):
+            source.close()
+        merged.append(file_name)
+        print(
+            f'{file_name}: заданий добавлено или изменено {counts["jobs"]}, лотов новых {counts["new"]}, обновлено {counts["updated"]}, строк log {counts["log"]}, errors {counts["errors"]}'
+        )
+    return merged
+
+
+def source_rows(source, name):
+    """Records of the table of the merged file (nothing if it has no table)"""
+
+    if not isinstance(source, SQLiteStore) and name not in source.sheetnames:
+        return []
+    table = get_wrapper(source, name, None)
+    return [table[i] for i in range(len(table))]
+
+
+def lot_rank(record):
+    """Completeness of the lot: stage 2 status, then date of the last update"""
+
+    return STAGE2_RANK.get(record["stage2"], 0), lot_date(record)
+
+
+@metrics.timed("parse", "search entries")
+def work_with_searchresult(lots, soup, site=None):
+    site = site or base_url
     count = 0
     for data_block in soup.find_all(
         "div", class_="search-registry-entry-block box-shadow-search-input"
     ):
         count += 1
 
+        # название проверяется по чёрному списку раньше остального разбора
+        body = data_block.find("div", class_="registry-entry__body")
+        part = body.find("div", class_="registry-entry__body-value")
+        name = part.text.strip()
+        name = name.replace("\n", " ").replace("\r", " ").replace("  ", " ")
+        if blacklist.match(name.lower()):
+            # print(f'BAD {name=}')
+            continue
+
         record = {
             "stage2": "none",
             "stage3": "no",
@@ -385,7 +1496,7 @@ def work_with_searchresult(lots, soup):
         part = data_block.find("div", class_="registry-entry__header-mid__number")
         a = part.find("a")
         if record["fz"] == "44-ФЗ":
-            record["link"] = base_url + a["href"]
+            record["link"] = site + a["href"]
         else:
             record["link"] = a["href"]
 
@@ -396,26 +1507,11 @@ def work_with_searchresult(lots, soup):
 
         part = data_block.find("div", class_="registry-entry__header-mid__title")
         record["stage"] = part.text.strip()
-
-        body = data_block.find("div", class_="registry-entry__body")
-
-        part = body.find("div", class_="registry-entry__body-value")
-        name = part.text.strip()
-        record["name"] = name.replace("\n", " ").replace("\r", " ").replace("  ", " ")
-        low_name = record["name"].lower()
-
-        bad_flag = False
-        for bad in bad_list:
-            if re.search(bad, low_name):
-                bad_flag = True
-                break
-        if bad_flag:
-            # print(f'BAD {record["name"]=}')
-            continue
+        record["name"] = name
 
         part = body.find("div", class_="registry-entry__body-href")
         a = part.find("a")
-        record["agency_link"] = base_url + a["href"]
+        record["agency_link"] = site + a["href"]
         record["agency"] = a.text.strip()
 
         right = data_block.find(
@@ -453,233 +1549,514 @@ def work_with_searchresult(lots, soup):
     return count
 
 
-def do_stage_three(wb):
+def do_stage_three(wb, workers=1, retries=RETRIES):
     lots = get_wrapper(wb, "lots", 2)
     lots_count = len(lots)
     if lots_count <= 0:
         print("В файле не найдено данных о торгах")
         return
 
-    # common_info = 'https://zakupki.gov.ru/epz/order/notice/ea44/view/common-info.html'
-    # supp_base = 'https://zakupki.gov.ru/epz/order/notice/ea44/view/supplier-results.html'
-    documents = "https://zakupki.gov.ru/epz/order/notice/ea44/view/documents.html"
+    progress = DownloadProgress()
+    store = FileStore(STORE_DIR_NAME)
+    retry_queue = RetryQueue(3, retries)
+
+    # Списки документов и сами файлы всех отмеченных лотов скачиваются
+    # в одном пуле потоков; статус лота записывает только основной поток
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        lot_tasks = {}
+
+        def submit(index, func, *args):
+            futures[executor.submit(func, *args)] = (index, func, args)
+
+        for index in range(lots_count):
+            record = lots[index]
+            if record["stage3"] in ["no", "done"]:
+                continue
+            if not in_shard(lot_key((record["number"],))):
+                continue
+
+            lot_tag = f'Лот {record["ID"]:03n} {record["price"]*1e-6:.3f} М руб'
+            if not os.path.isdir(lot_tag):
+                os.mkdir(lot_tag)
+
+            print(lot_tag)
+
+            lot_tasks[index] = {"left": 1, "error": False}
+            submit(index, get_attachments, record, lot_tag)
+
+        while futures or retry_queue:
+            for future in wait_done(futures, retry_queue):
+                index, func, args = futures.pop(future)
+                task = lot_tasks[index]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # у get_attachments - папка лота, у download_file - файл
+                    if retry_queue.failed(args[1], (index, func, args), e):
+                        continue
+                    task["left"] -= 1
+                    task["error"] = True
+                    continue
 
-    for index in range(lots_count):
-        record = lots[index]
-        if record["stage3"] in ["no", "done"]:
-            continue
+                task["left"] -= 1
+                if func is get_attachments:
+                    progress.add_files(len(result))
+                    for src, dest in result:
+                        submit(index, download_file, src, dest, progress, store)
+                        task["left"] += 1
 
-        lot_tag = f'Лот {record["ID"]:03n} {record["price"]*1e-6:.3f} М руб'
-        if not os.path.isdir(lot_tag):
-            os.mkdir(lot_tag)
+                if task["left"] == 0 and not task["error"]:
+                    lots[index] = {"stage3": "done"}
 
-        print(lot_tag)
+            for index, func, args in retry_queue.due():
+                submit(index, func, *args)
 
-        number = record["number"].replace('"', "")
-        params = {"regNumber": number}
+    save_failures(wb, retry_queue)
+    if progress.files:
+        progress.report()
+    store.report()
+    store.close()
 
-        try:
-            response = requests.get(
-                documents,
-                headers=headers,
-                params=params,
-                timeout=60,
-            )
-        except Exception as e:
-            print(
-                "Какая-то ошибка с получением информации с сайта, запустите программу ещё раз на третий этап"
-            )
-            print("Вот описание ошибки:")
-            print(e)
-            continue
 
-        if response.status_code != 200:
-            print("Ошибка связи с сайтом. Запустите программу ещё раз")
-            print(f"Request url {response.request.url} result {response.status_code}")
-            continue
+def get_attachments(record, lot_tag):
+    """Get list of attachments of the lot
+
+    Input: `record` - record from the `lots` sheet,
+        `lot_tag` - folder for files of the lot
+    Output: list of pairs (url, destination file name)"""
+
+    documents = base_url + "/epz/order/notice/ea44/view/documents.html"
+
+    number = record["number"].replace('"', "")
+    params = {"regNumber": number}
+
+    response = http_client.get(
+        documents,
+        params=params,
+    )
+    if response.status_code != 200:
+        raise SiteError(response)
+
+    return parser_pool.parse(
+        parse_attachments, response.content, response.encoding, lot_tag
+    )
+
 
-        page = response.text
-        soup = BeautifulSoup(page, "html.parser")
-        block = soup.find("div", class_="cardWrapper outerWrapper")
-        block2 = block.find("div", class_="wrapper")
+def parse_attachments(content, encoding, lot_tag):
+    """Parse `documents.html`, see `get_attachments`"""
 
+    with metrics.timer("parse", "documents"):
+        soup = make_soup(decode(content, encoding), "attachments")
+        # если разобраны только вложения, обёрток карточки в дереве нет
+        block = soup.find("div", class_="cardWrapper outerWrapper") or soup
+        block2 = block.find("div", class_="wrapper") or block
+
+        attachments = []
         # block3 = block2.find('div', class_='first-row-active-documents')
         for att in block2.findAll("div", class_="attachment"):
             att2 = att.find("span", class_="section__value")
             att3 = att2.find("a")
             src = att3["href"]
             file_name = att3["title"].strip()
+
+            # Одноимённые вложения разводятся по именам до скачивания,
+            # чтобы при следующем запуске найти их недокачанные .part файлы
             dest = os.path.join(lot_tag, file_name)
-            dest = make_do_not_exists(dest)
+            while dest in [d for _, d in attachments]:
+                dest = next_file_name(dest)
+            attachments.append((src, dest))
+    return attachments
+
+
+class ParsePool:
+    """Parser of downloaded pages in worker processes
+
+    Download thread passes bytes of the page to `parse` and waits for
+    the plain records, so no more pages than download threads are held
+    in memory. With 0 processes pages are parsed in the calling thread
+
+    Input: `processes` - number of parser processes"""
+
+    def __init__(self, processes=0):
+        self.processes = processes
+        self.executor = None
+        if processes:
+            # spawn - как в Windows: fork из процесса с потоками небезопасен
+            self.executor = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_parser_process,
+                initargs=(parsing.backend, blacklist.patterns, base_url),
+            )
+
+    def parse(self, func, *args):
+        """Output: result of `func(*args)`"""
+
+        if self.executor is None:
+            return func(*args)
+        future = self.executor.submit(run_parser, func, *args)
+        result, counts, samples = future.result()
+        blacklist.add_counts(counts)
+        metrics.metrics.merge(samples)
+        return result
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def init_parser_process(backend, patterns, url):
+    """Set options of the command line in a parser process"""
+
+    global base_url, blacklist
+    import_modules()
+    parsing.backend = backend
+    blacklist = Blacklist(patterns)
+    base_url = url
+
+
+def run_parser(func, *args):
+    """Call `func(*args)` in a parser process
+
+    Output: (result, blacklist counts, metrics samples) of the call"""
+
+    blacklist.counts = [0] * len(blacklist.patterns)
+    metrics.metrics.samples.clear()
+    result = func(*args)
+    return result, blacklist.counts, dict(metrics.metrics.samples)
+
+
+class DownloadProgress:
+    """Thread-safe counter of downloaded files and bytes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.report_time = self.start_time
+        self.files = 0
+        self.files_done = 0
+        self.bytes = 0
+
+    def add_files(self, count):
+        with self.lock:
+            self.files += count
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes += count
+            now = time.monotonic()
+            if now - self.report_time < REPORT_INTERVAL:
+                return
+            self.report_time = now
+        self.report()
+
+    def file_done(self):
+        with self.lock:
+            self.files_done += 1
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        megabytes = self.bytes / 2**20
+        print(
+            f"Скачано {megabytes:.1f} МБ ({megabytes / elapsed:.2f} МБ/с), файлов {self.files_done} из {self.files}"
+        )
+
+
+def download_file(src, dest, progress, store):
+    """Download file by chunks, resuming it from `dest`.part if it exists
+
+    The file is kept in the `store` and linked to `dest`; a file already
+    downloaded from `src` is taken from the store without request
+
+    Input: `src` - url of the file, `dest` - desired file name,
+        `progress` - DownloadProgress of the stage, `store` - FileStore
+    Output: name of the saved file"""
+
+    stored = store.find(src)
+    if stored is None:
+        stored = fetch_file(src, dest + ".part", progress, store)
+    else:
+        print(f"Файл из {src} уже скачан")
+
+    # имя может быть занято файлом прошлого запуска с тем же содержимым
+    # или файлом, который только что сохранил другой поток
+    while not store.link(stored, dest):
+        if store.is_stored(stored, dest):
+            print(f"Файл {dest} уже есть")
+            break
+        dest = next_file_name(dest)
+    else:
+        print(f"Сохранили файл из {src} в {dest}")
+    progress.file_done()
+    return dest
+
+
+def fetch_file(src, part_name, progress, store):
+    """Download file into `part_name` and move it into the `store`
+
+    Output: path of the stored file"""
+
+    offset = os.path.getsize(part_name) if os.path.exists(part_name) else 0
 
-            print(f"Скачиваем файл из {src}")
-            file = requests.get(src, headers=headers, timeout=60)
-            print(f"Записываем файл в {dest}")
-            with open(dest, "wb") as f:
-                f.write(file.content)
+    # сжатие отключено, иначе смещения Range не совпадут с файлом на диске
+    request_headers = {"accept-encoding": "identity"}
+    if offset:
+        request_headers["range"] = f"bytes={offset}-"
+        print(f"Докачиваем файл из {src} с {offset} байта")
+    else:
+        print(f"Скачиваем файл из {src}")
+
+    with http_client.get(src, headers=request_headers, stream=True) as file:
+        if offset and file.status_code == 416:
+            # .part файл уже скачан целиком
+            mode = None
+        elif offset and file.status_code == 206:
+            content_range = file.headers.get("content-range", "")
+            if not content_range.startswith(f"bytes {offset}-"):
+                raise Exception(f"Request url {src} wrong range {content_range}")
+            mode = "ab"
+        elif file.status_code == 200:
+            mode = "wb"
+        else:
+            raise SiteError(file)
 
-            print(f"Сохранили файл {file_name} из {src} в {dest}")
+        if mode:
+            with open(part_name, mode) as f:
+                for chunk in file.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    progress.add_bytes(len(chunk))
 
-        record["stage3"] = "done"
-        lots[index] = record
+        etag = file.headers.get("etag")
+    return store.add(part_name, src, etag)
 
 
-def do_stage_two(wb):
+def do_stage_two(wb, workers=1, retries=RETRIES):
     lots = get_wrapper(wb, "lots", 2)
     lots_count = len(lots)
     if lots_count <= 0:
         print("В файле не найдено данных о торгах")
         return
 
-    common_info = "https://zakupki.gov.ru/epz/order/notice/ea44/view/common-info.html"
-    supp_base = (
-        "https://zakupki.gov.ru/epz/order/notice/ea44/view/supplier-results.html"
-    )
-
+    pending = []
     for index in range(lots_count):
         record = lots[index]
         if record["stage2"] not in ["none", "error"]:
             continue
+        if not in_shard(lot_key((record["number"],))):
+            continue
 
+        status = check_stage_two(index, record)
+        if status:
+            lots[index] = {"stage2": status}
+            continue
+
+        pending.append((index, record))
+
+    if not pending:
+        return
+    print(f"Аукционов к обработке: {len(pending)}, потоков: {workers}")
+
+    details = LotDetails(wb)
+    retry_queue = RetryQueue(2, retries)
+    # Обе страницы лота скачиваются одновременно в пуле page_pool,
+    # а результат записывает в лист lots только основной поток
+    with ThreadPoolExecutor(max_workers=workers) as executor, ThreadPoolExecutor(
+        max_workers=2 * workers
+    ) as page_pool:
+        futures = {}
+        for index, record in pending:
+            future = executor.submit(enrich_lot, record, page_pool)
+            futures[future] = (index, record)
+
+        while futures or retry_queue:
+            for future in wait_done(futures, retry_queue):
+                index, record = futures.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    if retry_queue.failed(lot_text(record), (index, record), e):
+                        continue
+                    # собранные прошлыми запусками участники и товары остаются
+                    record["stage2"] = "error"
+                    lots[index] = {"stage2": "error"}
+                else:
+                    details.write(lots, index, record)
+                print(
+                    f'Аукцион #{index+1:3d} из {lots_count:3d}, на сумму {record["price"]} руб., опубликован {record["published"]}, название `{record["name"]}`: {record["stage2"]}'
+                )
+
+            for index, record in retry_queue.due():
+                future = executor.submit(enrich_lot, record, page_pool)
+                futures[future] = (index, record)
+
+    save_failures(wb, retry_queue)
+
+
+def check_stage_two(index, record):
+    """Status of the lot which does not need stage 2 requests or None
+
+    Input: `index` - position of the lot, `record` - record from the `lots` sheet"""
+
+    status = stage_two_status(record)
+    if status == "done":
+        print(f'Аукцион #{index+1:3d}: {record["stage"]}, пропускаю.')
+    elif status == "no_law":
         print(
-            f'Аукцион #{index+1:3d} из {lots_count:3d}, на сумму {record["price"]} руб., опубликован {record["published"]}, название `{record["name"]}`'
+            f'Аукцион #{index+1:3d}: поддержка поиска торгов по закону {record["fz"]} пока не реализована, пропускаю'
+        )
+    return status
+
+
+def stage_two_status(record):
+    """Status of the lot which does not need stage 2 requests or None"""
+
+    if record["stage"] == "Определение поставщика отменено":
+        return "done"
+    if record["fz"] != "44-ФЗ":
+        return "no_law"
+    return None
+
+
+def enrich_lot(record, page_pool):
+    """Collect stage 2 information about the lot
+
+    Input: `record` - record from the `lots` sheet,
+        `page_pool` - executor used to download lot pages simultaneously
+    Output: the record with supplier and goods information and `stage2`
+        set to `done`; errors of requests and parsing are raised"""
+
+    common_info = base_url + "/epz/order/notice/ea44/view/common-info.html"
+    supp_base = base_url + "/epz/order/notice/ea44/view/supplier-results.html"
+
+    number = record["number"].replace('"', "")
+    params = {"regNumber": number}
+    # страницы завершённых закупок уже не меняются, их можно дольше хранить в кэше
+    final = record["stage"] == "Определение поставщика завершено"
+
+    # скачиваем инфу о поставщике и о товарах
+    supp_future = page_pool.submit(fetch_lot_page, supp_base, params, final)
+    common_future = page_pool.submit(fetch_lot_page, common_info, params, final)
+    supp_page = supp_future.result()
+    common_page = common_future.result()
+
+    # участники и товары прошлого сбора (или колонки прежних версий на
+    # листе lots) заменяются собранными сейчас
+    record, _ = split_record("lots", record)
+    for parse, response in [
+        (parse_supplier_results, supp_page),
+        (parse_common_info, common_page),
+    ]:
+        record.update(
+            parser_pool.parse(
+                parse_lot_page, parse, response.content, response.encoding
+            )
         )
 
-        if record["stage"] == "Определение поставщика отменено":
-            print(f'{record["stage"]}, пропускаю.')
-            record["stage2"] = "done"
-            lots[index] = record
-            continue
+    record["stage2"] = "done"
+    return record
 
-        if record["fz"] != "44-ФЗ":
-            print(
-                f'Поддержка поиска торгов по закону {record["fz"]} пока не реализована, пропускаю'
-            )
-            record["stage2"] = "no_law"
-            lots[index] = record
-            continue
 
-        number = record["number"].replace('"', "")
-        params = {"regNumber": number}
+def fetch_lot_page(url, params, final=False):
+    """Download the page of the lot
 
-        # скачиваем инфу о поставщике
-        try:
-            response = requests.get(
-                supp_base,
-                headers=headers,
-                params=params,
-                timeout=60,
-            )
-        except Exception as e:
-            print(
-                "Какая-то ошибка с получением информации с сайта, запустите программу ещё раз на второй этап"
-            )
-            print("Вот описание ошибки:")
-            print(e)
-            record["stage2"] = "error"
-            lots[index] = record
-            continue
+    Input: `url` - address of the page, `params` - query parameters,
+        `final` - the procurement is completed and the page will not change
+    Output: response, raises SiteError if the site answered with an error"""
 
-        if response.status_code != 200:
-            print("Ошибка связи с сайтом. Запустите программу ещё раз")
-            print(f"Request url {response.request.url} result {response.status_code}")
-            record["stage2"] = "error"
-            lots[index] = record
-            continue
+    response = http_client.get(
+        url,
+        params=params,
+        final=final,
+    )
+    if response.status_code != 200:
+        raise SiteError(response)
+    return response
 
-        page = response.text
-        soup = BeautifulSoup(page, "html.parser")
-        block = soup.find("div", class_="cardWrapper outerWrapper")
-        block2 = block.find("div", class_="wrapper")
-        block3 = block2.find("div", class_="cardHeaderBlock")
-        block3_2 = block3.find_next_sibling("div")
-        block4 = block3_2.find("div", class_="row blockInfo")
-
-        for table in block4.find_all("table"):
-            thead = table.find("thead")
-            thead_tr = thead.find("tr")
-            thead_tr_th = thead_tr.find("th")
-            caption = thead_tr_th.text.strip()
-            if caption.startswith("Заказчик"):
-                tbody = table.find("tbody")
-                td = tbody.find("td")
-                record["customer"] = td.text.strip()
-            elif caption.startswith("Участник"):
-                tbody = table.find("tbody")
-                i = 0
-                for tr in tbody.find_all("tr"):
-                    i += 1
-                    td = tr.find("td")
-                    record[f"supplier{i}_name"] = td.text.strip()
-                    td2 = td.find_next_sibling("td")
-                    record[f"supplier{i}_status"] = td2.text.strip()
-                    td3 = td2.find_next_sibling("td")
-                    record[f"supplier{i}_price"] = td3.text.strip()
-
-        # скачиваем инфу о товарах
-        try:
-            response = requests.get(
-                common_info,
-                headers=headers,
-                params=params,
-                timeout=60,
-            )
-        except Exception as e:
-            print(
-                "Какая-то ошибка с получением информации с сайта, запустите программу ещё раз на второй этап"
-            )
-            print("Вот описание ошибки:")
-            print(e)
-            record["stage2"] = "error"
-            lots[index] = record
-            continue
 
-        if response.status_code != 200:
-            print("Ошибка связи с сайтом. Запустите программу ещё раз")
-            print(f"Request url {response.request.url} result {response.status_code}")
-            record["stage2"] = "error"
-            lots[index] = record
-            continue
+def parse_lot_page(parse, content, encoding):
+    """Parse page of the lot by `parse(page, record)`
+
+    Input: `content` - bytes of the page, `encoding` - its encoding
+    Output: dict of fields found on the page"""
+
+    info = {}
+    parse(decode(content, encoding), info)
+    return info
+
+
+@metrics.timed("parse", "supplier-results")
+def parse_supplier_results(page, record):
+    """Add customer and suppliers from `supplier-results.html` to the record"""
+
+    soup = make_soup(page, "suppliers")
+    block = soup.find("div", class_="cardWrapper outerWrapper")
+    block2 = block.find("div", class_="wrapper")
+    block3 = block2.find("div", class_="cardHeaderBlock")
+    block3_2 = block3.find_next_sibling("div")
+    block4 = block3_2.find("div", class_="row blockInfo")
 
-        page = response.text
-        soup = BeautifulSoup(page, "html.parser")
-        block = soup.find("div", id="positionKTRU")
-        table = block.find("table")
+    for table in block4.find_all("table"):
         thead = table.find("thead")
-        tbody = table.find("tbody")
-
-        code_table = {}
-        for i, th in enumerate(thead.find_all(["th", "td"])):
-            name = th.text.strip()
-            if name.startswith("Код"):
-                code_table[i] = "KTRU"
-            elif name.startswith("Наименование"):
-                code_table[i] = "name"
-            elif name.startswith("Количество"):
-                code_table[i] = "count"
-            elif name.startswith("Цена"):
-                code_table[i] = "price"
-            elif name.startswith("Стоимость"):
-                code_table[i] = "value"
-
-        good_number = 0
-        for row in tbody.find_all("tr", class_="tableBlock__row"):
-            good_number += 1
-            for i, val in enumerate(row.find_all("td")):
-                value = val.text.strip().replace("\r", "").replace("\n", "")
-                value = value.replace("\xa0", "")
-                value = value.replace("\u2264", "<=")
-                value = value.replace("\u2265", ">=")
-                value = value.replace("\u2070", "0")
-                while "  " in value:
-                    value = value.replace("  ", " ")
-
-                if i in code_table:
-                    fancy_name = f"good_{good_number:02d}_{code_table[i]}"
-                    record[fancy_name] = value
-
-        record["stage2"] = "done"
-        lots[index] = record
+        thead_tr = thead.find("tr")
+        thead_tr_th = thead_tr.find("th")
+        caption = thead_tr_th.text.strip()
+        if caption.startswith("Заказчик"):
+            tbody = table.find("tbody")
+            td = tbody.find("td")
+            record["customer"] = td.text.strip()
+        elif caption.startswith("Участник"):
+            tbody = table.find("tbody")
+            i = 0
+            for tr in tbody.find_all("tr"):
+                i += 1
+                td = tr.find("td")
+                record[f"supplier{i}_name"] = td.text.strip()
+                td2 = td.find_next_sibling("td")
+                record[f"supplier{i}_status"] = td2.text.strip()
+                td3 = td2.find_next_sibling("td")
+                record[f"supplier{i}_price"] = td3.text.strip()
+
+
+@metrics.timed("parse", "common-info")
+def parse_common_info(page, record):
+    """Add goods from the KTRU table of `common-info.html` to the record"""
+
+    soup = make_soup(page, "goods")
+    block = soup.find("div", id="positionKTRU")
+    table = block.find("table")
+    thead = table.find("thead")
+    tbody = table.find("tbody")
+
+    code_table = {}
+    for i, th in enumerate(thead.find_all(["th", "td"])):
+        name = th.text.strip()
+        if name.startswith("Код"):
+            code_table[i] = "KTRU"
+        elif name.startswith("Наименование"):
+            code_table[i] = "name"
+        elif name.startswith("Количество"):
+            code_table[i] = "count"
+        elif name.startswith("Цена"):
+            code_table[i] = "price"
+        elif name.startswith("Стоимость"):
+            code_table[i] = "value"
+
+    good_number = 0
+    for row in tbody.find_all("tr", class_="tableBlock__row"):
+        good_number += 1
+        for i, val in enumerate(row.find_all("td")):
+            value = val.text.strip().replace("\r", "").replace("\n", "")
+            value = value.replace("\xa0", "")
+            value = value.replace("\u2264", "<=")
+            value = value.replace("\u2265", ">=")
+            value = value.replace("\u2070", "0")
+            while "  " in value:
+                value = value.replace("  ", " ")
+
+            if i in code_table:
+                fancy_name = f"good_{good_number:02d}_{code_table[i]}"
+                record[fancy_name] = value
 
 
 if __name__ == "__main__":